@@ -0,0 +1,189 @@
+# Description: Monte Carlo EM estimation of the offspring distribution from a batch of independent samples
+# Author: agent
+# Date: October 2026
+import os
+from multiprocessing import Pool
+import numpy as np
+from chain_state import SampleModel
+from compact_tree import as_compact_tree
+from graph_mcmc import mcmc_walk
+from multi_chain import initial_tree
+from optimization import pooled_em_update, pooled_importance_sample_size
+from reducers import OffspringCounts, LastState, make_stopping
+from seeding import seed_process, spawn_seeds
+from subtree_cache import CanonicalForms, canonical_ids
+
+# -------------------------------------------------------------------------
+# Distinct observations of a batch
+# -------------------------------------------------------------------------
+# The posterior of the hidden tree of an observation only depends on the
+# shape of S and on the number of sampled nodes, so observations whose
+# samples are isomorphic, which is common for small samples, are
+# estimated by a single chain.
+# -------------------------------------------------------------------------
+# observations: A list of pairs (S, n_sampled_nodes)
+# -------------------------------------------------------------------------
+# Returns: A list with the distinct observations, the index of the distinct
+#          observation of every observation and the number of observations
+#          with each distinct observation
+# -------------------------------------------------------------------------
+def distinct_observations(observations):
+    forms = CanonicalForms(2**20)
+
+    keys = {}
+    distinct = []
+    index = np.empty(len(observations), dtype=np.int64)
+    for i, (S, n_sampled_nodes) in enumerate(observations):
+        S = as_compact_tree(S)
+        key = (int(canonical_ids(S, forms)[0]), n_sampled_nodes)
+        if key not in keys:
+            keys[key] = len(distinct)
+            distinct.append((S, n_sampled_nodes))
+        index[i] = keys[key]
+
+    return distinct, index, np.bincount(index, minlength=len(distinct))
+
+# -------------------------------------------------------------------------
+# Run the chains of a chunk of observations
+# -------------------------------------------------------------------------
+# The chains of a chunk run one after the other in the same process and
+# share the canonical forms of their subtrees. A chain without a previous
+# state starts from its sample completed to L levels and is burned in, the
+# others start from their last state.
+# -------------------------------------------------------------------------
+# task: Tuple with the seed of the chunk, a list of triples (S,
+#       n_sampled_nodes, last state or None) and the arguments of the walks
+# -------------------------------------------------------------------------
+# Returns: A list with the offspring counts, their multiplicities and the
+#          last state of each chain
+# -------------------------------------------------------------------------
+def _run_chunk(task):
+    (seed, chains, W, L, offspring_distribution, p, n_steps, burn_in, thinning,
+     target_ess, target_se, n_tries) = task
+
+    # Every chunk has its own random stream
+    seed_process(seed)
+
+    forms = CanonicalForms(2**16)
+    results = []
+    for S, n_sampled_nodes, G in chains:
+        model = SampleModel(S, n_sampled_nodes, p, offspring_distribution, forms=forms)
+
+        chain_burn_in = 0
+        if G is None:
+            G = initial_tree(S, W, L, offspring_distribution)
+            chain_burn_in = burn_in
+
+        (counts, multiplicity), G = mcmc_walk(G, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps,
+                                              chain_burn_in, thinning, reducers=[OffspringCounts(), LastState()],
+                                              stopping=make_stopping(target_ess, target_se), n_tries=n_tries,
+                                              model=model)
+        results.append((counts, multiplicity, G))
+
+    return results
+
+# -------------------------------------------------------------------------
+# Monte Carlo EM over a batch of independent observations
+# -------------------------------------------------------------------------
+# Every observation is a sample (S, n_sampled_nodes) of its own hidden
+# tree, all of them generated by the same Galton-Watson process. The E-step
+# runs one chain per distinct observation (see distinct_observations),
+# with the chains split into chunks run in a process pool, and the M-step
+# pools the expected offspring counts of all the observations (see
+# optimization.pooled_em_update).
+#
+# As in monte_carlo_em.monte_carlo_em, the states of a chain are reused
+# with importance weights while their effective sample size stays above
+# min_ess_fraction of the number of states, so after the first iterations
+# only the chains whose weights degenerated are run again, each starting
+# from its last state.
+# -------------------------------------------------------------------------
+# observations: A list of pairs (S, n_sampled_nodes)
+# W: Maximum out-degree of the hidden trees
+# L: Number of levels of the hidden trees
+# p: Probability that a node is sampled
+# theta_0: Initial offspring distribution
+# n_steps: Number of steps of each chain (the cap of its length if it
+#          stops adaptively)
+# max_iterations: Maximum number of EM iterations
+# tolerance: Largest change of the estimate for the iterations to stop
+# min_ess_fraction: Fraction of the states under which the effective
+#                   sample size of a chain triggers a new run of it
+# burn_in: Number of initial states of the first run of each chain that are discarded
+# thinning: Keep one state of each chain every thinning steps
+# target_ess: If given, each chain stops once the offspring frequencies
+#             reach this effective sample size
+# target_se: If given, each chain stops once the standard errors of the
+#            offspring frequencies are below this value
+# n_tries: Number of candidates of each step of the chains
+# seed: Seed from which the seeds of the chunks are derived
+# n_processes: Number of processes of the pool (one per core if None, no
+#              pool if 1)
+# chunk_size: Number of chains of each chunk (four chunks per process if None)
+# -------------------------------------------------------------------------
+# Returns: The estimated distribution and a list with a dictionary per
+#          iteration (estimate, number of chains run, smallest effective
+#          sample size, number of states and change of the estimate)
+# -------------------------------------------------------------------------
+def batch_monte_carlo_em(observations, W, L, p, theta_0, n_steps, max_iterations=20, tolerance=1e-3,
+                         min_ess_fraction=0.5, burn_in=0, thinning=1, target_ess=None, target_se=None, n_tries=1,
+                         seed=None, n_processes=None, chunk_size=None):
+    distinct, _, n_observations = distinct_observations(observations)
+    n_chains = len(distinct)
+    n_processes = os.cpu_count() if n_processes is None else n_processes
+    seed_sequence = np.random.SeedSequence(seed)
+
+    theta = np.asarray(theta_0, dtype=np.float64)
+    last_states = [None]*n_chains
+    statistics = [None]*n_chains
+    theta_g = np.tile(theta, (n_chains, 1))
+    ess = np.zeros(n_chains)
+    history = []
+
+    pool = Pool(n_processes) if n_processes > 1 else None
+    try:
+        for _ in range(max_iterations):
+            # E-step: run again the chains without states or whose weights are too unbalanced
+            n_states = np.array([0 if s is None else s[1].sum() for s in statistics])
+            stale = np.flatnonzero((n_states == 0) | (ess < min_ess_fraction * n_states))
+
+            if len(stale) > 0:
+                size = chunk_size or -(-len(stale) // (4 * n_processes))
+                chunks = [stale[start:start + size] for start in range(0, len(stale), size)]
+                seeds = spawn_seeds(seed_sequence, len(chunks))
+
+                tasks = [(seeds[k], [distinct[j] + (last_states[j],) for j in chunk], W, L, theta, p, n_steps,
+                          burn_in, thinning, target_ess, target_se, n_tries) for k, chunk in enumerate(chunks)]
+                results = pool.map(_run_chunk, tasks) if pool is not None else [_run_chunk(task) for task in tasks]
+
+                for chunk, chunk_results in zip(chunks, results):
+                    for j, (counts, multiplicity, G) in zip(chunk, chunk_results):
+                        statistics[j] = (counts, multiplicity)
+                        last_states[j] = G
+                        theta_g[j] = theta
+
+            # Sufficient statistics of all the chains, stacked for the vectorized M-step
+            counts = np.concatenate([s[0] for s in statistics])
+            multiplicity = np.concatenate([s[1] for s in statistics])
+            observation = np.repeat(np.arange(n_chains), [len(s[1]) for s in statistics])
+
+            ess = pooled_importance_sample_size(counts, multiplicity, observation, theta, theta_g)
+
+            # M-step
+            new_theta = pooled_em_update(counts, multiplicity, observation, theta, theta_g, n_observations)
+            change = np.abs(new_theta - theta).max()
+            theta = new_theta
+
+            history.append({'theta': theta, 'n_new_chains': len(stale), 'min_ess': float(ess.min()),
+                            'n_states': int(multiplicity.sum()), 'change': change})
+            if change < tolerance:
+                break
+
+            # Effective sample sizes under the new estimate, for the next E-step
+            ess = pooled_importance_sample_size(counts, multiplicity, observation, theta, theta_g)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return theta, history
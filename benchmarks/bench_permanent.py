@@ -0,0 +1,101 @@
+# Description: Benchmark of the permanent engine against the cofactor expansion it replaced
+# Author: agent
+# Date: October 2026
+#
+# Usage (from the root of the repository):
+#     python -m benchmarks.bench_permanent [--max-size 14] [--max-legacy-size 8] [--batch-size 32]
+import argparse
+import time
+import numpy as np
+from permanent import batch_log_permanent
+
+# -------------------------------------------------------------------------
+# Cofactor expansion previously used by sampling_model._map_count_operator
+# -------------------------------------------------------------------------
+# maps_matrix: The auxiliary matrix
+# -------------------------------------------------------------------------
+# Returns: The permanent of maps_matrix
+# -------------------------------------------------------------------------
+def cofactor_permanent(maps_matrix):
+    if not isinstance(maps_matrix, np.ndarray):
+        return maps_matrix
+    elif maps_matrix.shape[0] == 1:
+        return maps_matrix.sum()
+    else:
+        new_maps = np.delete(maps_matrix, 0, 0)
+        return sum([maps_matrix[0,j]*cofactor_permanent(np.delete(new_maps, j, 1)) for j in range(new_maps.shape[1])])
+
+# -------------------------------------------------------------------------
+# Best wall-clock time of a function over a few repetitions
+# -------------------------------------------------------------------------
+# function: Function to be timed
+# matrix: Argument of the function
+# repeat: Number of repetitions
+# -------------------------------------------------------------------------
+# Returns: The smallest time in seconds and the value returned by the function
+# -------------------------------------------------------------------------
+def best_time(function, matrix, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function(matrix)
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+# -------------------------------------------------------------------------
+# Run the benchmark
+# -------------------------------------------------------------------------
+# The matrices are k x c blocks of map counts like the ones stacked by
+# chain_state.SampleModel.node_log_maps, with k children of a node of S
+# and c >= k children of a node of G, given to the engine in log scale.
+# Each size is timed on a single block and on a batch of blocks, the
+# latter reported per block.
+# -------------------------------------------------------------------------
+# max_size: Largest number of rows of the blocks
+# max_legacy_size: Largest size timed with the cofactor expansion, which takes O(n!) time
+# batch_size: Number of blocks of each batch
+# seed: Seed of the random blocks
+# -------------------------------------------------------------------------
+# Returns: A list with one dictionary of timings per size
+# -------------------------------------------------------------------------
+def run(max_size=14, max_legacy_size=8, batch_size=32, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+
+    print(f"{'shape':>8} {'cofactor (s)':>14} {'engine (s)':>12} {'batched (s)':>12} {'speedup':>10}")
+    for k in range(2, max_size + 1):
+        blocks = rng.integers(0, 4, (batch_size, k, k + k // 2)).astype(np.float64)
+        with np.errstate(divide='ignore'):
+            log_blocks = np.log(blocks)
+
+        repeat = 3 if k <= 10 else 1
+        engine_time, engine_value = best_time(batch_log_permanent, log_blocks[:1], repeat)
+        batch_time, batch_value = best_time(batch_log_permanent, log_blocks, repeat)
+        assert np.allclose(batch_value[0], engine_value[0])
+
+        legacy_time = None
+        if k <= max_legacy_size:
+            legacy_time, legacy_value = best_time(cofactor_permanent, blocks[0], repeat if k <= 6 else 1)
+            assert np.isclose(np.exp(engine_value[0]), float(legacy_value))
+
+        speedup = legacy_time / engine_time if legacy_time is not None else None
+        rows.append({'shape': blocks.shape[1:], 'cofactor': legacy_time, 'engine': engine_time,
+                     'batched': batch_time / batch_size, 'speedup': speedup})
+
+        shape = f'{blocks.shape[1]}x{blocks.shape[2]}'
+        legacy = f'{legacy_time:14.6f}' if legacy_time is not None else f"{'-':>14}"
+        ratio = f'{speedup:10.1f}' if speedup is not None else f"{'-':>10}"
+        print(f'{shape:>8} {legacy} {engine_time:12.6f} {batch_time / batch_size:12.6f} {ratio}')
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the permanent engine')
+    parser.add_argument('--max-size', type=int, default=14)
+    parser.add_argument('--max-legacy-size', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.max_size, args.max_legacy_size, args.batch_size, args.seed)
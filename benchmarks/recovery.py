@@ -0,0 +1,79 @@
+# Description: Check that the batch Monte Carlo EM recovers the offspring distribution of synthetic trees
+# Author: agent
+# Date: October 2026
+#
+# Usage (from the root of the repository):
+#     python -m benchmarks.recovery [--n-trees 200] [--L 4] [--p 0.5 0.8]
+#                                   [--theta 0.3 0.4 0.3] [--tolerance 0.05]
+import argparse
+import time
+import numpy as np
+from batch_inference import batch_monte_carlo_em
+from optimization import em_update, offspring_count_matrix, unique_offspring_counts
+from sampling_model import galton_watson_forest, sample
+from seeding import seed_process
+
+# -------------------------------------------------------------------------
+# Run the check
+# -------------------------------------------------------------------------
+# The hidden trees are drawn from theta and sampled with each p. The
+# estimate of the EM update on the hidden trees themselves is the best any
+# estimator can do with them, so both it and the batch estimate from the
+# samples must be within tolerance of theta.
+# -------------------------------------------------------------------------
+# theta: Offspring distribution of the hidden trees
+# n_trees: Number of hidden trees
+# L: Number of levels of the hidden trees
+# p_values: Probabilities that a node is sampled
+# n_steps: Number of steps of each chain
+# tolerance: Largest error allowed in any entry of the estimates
+# seed: Seed of the trees, the samples and the chains
+# n_processes: Number of processes of the pool of the batch EM
+# -------------------------------------------------------------------------
+# Returns: A list with one dictionary per estimate
+# -------------------------------------------------------------------------
+def run(theta, n_trees=200, L=4, p_values=(0.5, 0.8), n_steps=300, tolerance=0.05, seed=0, n_processes=1):
+    theta = np.asarray(theta, dtype=np.float64)
+    W = len(theta)
+    uniform = np.full(W, 1/W)
+
+    seed_process(seed)
+    trees = galton_watson_forest(theta, L, n_trees)
+
+    # M-step on the fully observed trees
+    counts, multiplicity = unique_offspring_counts(offspring_count_matrix(trees, W))
+    rows = [{'p': 1.0, 'estimate': em_update(counts, multiplicity, uniform, uniform), 'time': 0.0}]
+
+    for p in p_values:
+        observations = [sample(G, p) for G in trees]
+
+        start = time.perf_counter()
+        estimate, _ = batch_monte_carlo_em(observations, W, L, p, uniform, n_steps, max_iterations=30, burn_in=50,
+                                           seed=seed, n_processes=n_processes)
+        rows.append({'p': p, 'estimate': estimate, 'time': time.perf_counter() - start})
+
+    print(f"{'p':>6} {'estimate':>30} {'error':>8} {'time (s)':>10}")
+    for row in rows:
+        row['error'] = float(np.abs(row['estimate'] - theta).max())
+        estimate = np.array2string(row['estimate'], precision=3)
+        print(f"{row['p']:6.2f} {estimate:>30} {row['error']:8.3f} {row['time']:10.2f}")
+
+    for row in rows:
+        assert row['error'] <= tolerance, f"p = {row['p']}: estimate {row['estimate']} is not within {tolerance} of {theta}"
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recovery check of the batch Monte Carlo EM')
+    parser.add_argument('--theta', type=float, nargs='+', default=[0.3, 0.4, 0.3])
+    parser.add_argument('--n-trees', type=int, default=200)
+    parser.add_argument('--L', type=int, default=4)
+    parser.add_argument('--p', type=float, nargs='+', default=[0.5, 0.8])
+    parser.add_argument('--n-steps', type=int, default=300)
+    parser.add_argument('--tolerance', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-processes', type=int, default=1)
+    args = parser.parse_args()
+
+    run(args.theta, args.n_trees, args.L, args.p, args.n_steps, args.tolerance, args.seed, args.n_processes)
@@ -0,0 +1,283 @@
+# Description: Benchmark suite of the hot paths of the estimator over a sweep of parameters
+# Author: agent
+# Date: October 2026
+#
+# Usage (from the root of the repository):
+#     python -m benchmarks.suite [--W 3 10 20] [--L 3 4 ... 12] [--p 0.2 0.5 0.8]
+#                                [--n-steps 1000] [--output benchmarks/results/suite.json]
+#                                [--baseline previous.json]
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from scipy.stats import zipfian
+from chain_state import ChainState
+from graph_mcmc import proposal_transition, acceptance_function, mcmc_walk
+from optimization import optimized_distribution
+from permanent import batch_log_permanent
+from reducers import OffspringCounts
+from run import truncated_poisson_pmf, lambda_poisson, a as zipf_a
+from runner import run_seed
+from seeding import seed_process
+from sampling_model import _log_map_count, sampling_probability, galton_watson, galton_watson_forest, sample
+
+# Largest expected number of nodes of the trees of a configuration
+MAX_EXPECTED_NODES = 20000
+
+# -------------------------------------------------------------------------
+# Truncated geometric offspring distribution
+# -------------------------------------------------------------------------
+# A truncated geometric distribution on 1, ..., W children. Its mean stays
+# below 2 for every W, so the trees of the sweep keep a size that the
+# chain can handle up to L = 12.
+# -------------------------------------------------------------------------
+# W: Maximum number of children
+# ratio: Ratio between the probabilities of consecutive numbers of children
+# -------------------------------------------------------------------------
+# Returns: A list of probabilities that a node has 1, 2, ..., W children
+# -------------------------------------------------------------------------
+def geometric_distribution(W, ratio=0.45):
+    weights = ratio**np.arange(W)
+    return (weights/weights.sum()).tolist()
+
+# -------------------------------------------------------------------------
+# Offspring distributions benchmarked for a maximum out-degree
+# -------------------------------------------------------------------------
+# The geometric distribution hardly ever gives a node more than 4 children,
+# so for W >= 10 the sweep uses the truncated Poisson and Zipf
+# distributions of run.py instead, whose wide nodes make the permanents of
+# the map counting wide as well.
+# -------------------------------------------------------------------------
+# W: Maximum number of children
+# -------------------------------------------------------------------------
+# Returns: A list of pairs with the name of each distribution and its
+#          probabilities that a node has 1, 2, ..., W children
+# -------------------------------------------------------------------------
+def benchmark_distributions(W):
+    if W < 10:
+        return [('geometric', geometric_distribution(W))]
+
+    poisson = np.array([truncated_poisson_pmf(0, W + 1, k, lambda_poisson) for k in range(1, W + 1)])
+    zipf = np.array([zipfian.pmf(k, zipf_a, W) for k in range(1, W + 1)])
+    return [('poisson', (poisson/poisson.sum()).tolist()), ('zipf', (zipf/zipf.sum()).tolist())]
+
+# -------------------------------------------------------------------------
+# Largest number of levels benchmarked for a distribution
+# -------------------------------------------------------------------------
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children
+# max_nodes: Largest expected number of nodes of the trees
+# -------------------------------------------------------------------------
+# Returns: The largest L whose trees have at most max_nodes nodes on average
+# -------------------------------------------------------------------------
+def max_levels(offspring_distribution, max_nodes=MAX_EXPECTED_NODES):
+    mean = np.arange(1, len(offspring_distribution) + 1) @ np.asarray(offspring_distribution)
+    L, expected_nodes = 1, 1.0
+    while expected_nodes + mean**L <= max_nodes:
+        expected_nodes += mean**L
+        L += 1
+    return L
+
+# -------------------------------------------------------------------------
+# Blocks of log map counts of the widest node of G
+# -------------------------------------------------------------------------
+# The row of the widest internal node g of G that faces internal nodes of
+# S is computed as in chain_state.SampleModel.node_log_maps: the rows of
+# the children of g are stacked into one batch of k x c blocks per group
+# of nodes of S with k children, c being the number of children of g.
+# -------------------------------------------------------------------------
+# state: ChainState of G
+# -------------------------------------------------------------------------
+# Returns: A list with the (batch x k x c) array of log map counts of every
+#          group (empty if S has no internal nodes)
+# -------------------------------------------------------------------------
+def wide_log_blocks(state):
+    G, model = state.tree, state.model
+    candidates = np.flatnonzero((G.depth < len(model.levels)) & (G.out_degree > 0))
+    candidates = [g for g in candidates if model.degree_groups[G.depth[g]]]
+    if not candidates:
+        return []
+    g = max(candidates, key=lambda g: G.out_degree[g])
+
+    children_rows = np.stack(state.log_maps[G.successors(g)])
+    return [children_rows[:, children].transpose(1, 2, 0) for _, _, children in model.degree_groups[G.depth[g]]]
+
+# -------------------------------------------------------------------------
+# Time a function and measure its peak memory
+# -------------------------------------------------------------------------
+# The function is called once under tracemalloc for the peak memory and
+# repeat times without it for the time. The random generators are seeded
+# before every call, so every call does the same work.
+# -------------------------------------------------------------------------
+# function: Function without arguments to be measured
+# repeat: Number of timed calls
+# seed: Seed of the random generators
+# -------------------------------------------------------------------------
+# Returns: The smallest time in seconds and the peak memory in bytes
+# -------------------------------------------------------------------------
+def measure(function, repeat, seed):
+    seed_process(seed)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = float('inf')
+    for _ in range(repeat):
+        seed_process(seed)
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, peak_memory
+
+# -------------------------------------------------------------------------
+# Benchmark every hot path on a single configuration
+# -------------------------------------------------------------------------
+# W: Maximum out-degree of the trees
+# L: Number of levels of the trees
+# p: Probability that a node is sampled
+# distribution: Name of the offspring distribution
+# dist: Offspring distribution of the trees (see benchmark_distributions)
+# n_steps: Number of steps of the timed walk
+# n_proposals: Number of proposals of the timed proposal and acceptance calls
+# repeat: Number of timed calls of each function
+# seed: Seed of the configuration
+# -------------------------------------------------------------------------
+# Returns: A list with one dictionary of measurements per function
+# -------------------------------------------------------------------------
+def benchmark_configuration(W, L, p, distribution, dist, n_steps, n_proposals, repeat, seed):
+    seed_process(seed)
+
+    # The size of Galton-Watson trees varies a lot, the tree of median size is benchmarked
+    trees = galton_watson_forest(dist, L, 9)
+    G = sorted(trees, key=len)[len(trees) // 2]
+    S, n_sampled_nodes = sample(G, p)
+    state = ChainState.from_tree(G, S, n_sampled_nodes, p, dist)
+
+    # Permanents of the map counting at the widest node of G
+    log_blocks = wide_log_blocks(state)
+    permanent_shape = list(max((blocks.shape for blocks in log_blocks), key=lambda shape: shape[1], default=()))
+
+    # Proposals from the same state, and a sample of the walk for the EM step
+    proposals = [proposal_transition(state, W, L, dist) for _ in range(n_proposals)]
+    (counts, multiplicity), = mcmc_walk(G, S, n_sampled_nodes, W, L, dist, p, n_steps, reducers=[OffspringCounts()])
+
+    cases = [
+        ('batch_log_permanent', 1, lambda: [batch_log_permanent(blocks) for blocks in log_blocks]),
+        ('log_map_count', 1, lambda: _log_map_count(S, G)),
+        ('sampling_probability', 1, lambda: sampling_probability(S, G, p, n_sampled_nodes)),
+        ('galton_watson', 1, lambda: galton_watson(dist, L)),
+        ('sample', 1, lambda: sample(G, p)),
+        ('chain_state', 1, lambda: ChainState.from_tree(G, S, n_sampled_nodes, p, dist)),
+        ('proposal_transition', n_proposals,
+         lambda: [proposal_transition(state, W, L, dist) for _ in range(n_proposals)]),
+        ('acceptance_function', n_proposals,
+         lambda: [acceptance_function(S, n_sampled_nodes, state, proposal, p, dist, forward, backward)
+                  for proposal, forward, backward in proposals]),
+        ('acceptance_function_trees', 1,
+         lambda: acceptance_function(S, n_sampled_nodes, state.tree, proposals[0][0].tree, p, dist,
+                                     proposals[0][1], proposals[0][2])),
+        ('mcmc_walk', n_steps,
+         lambda: mcmc_walk(G, S, n_sampled_nodes, W, L, dist, p, n_steps, reducers=[OffspringCounts()])),
+        ('optimized_distribution', 1, lambda: optimized_distribution(counts, dist, multiplicity)),
+    ]
+
+    rows = []
+    for name, n_calls, function in cases:
+        seconds, peak_memory = measure(function, repeat, seed)
+        rows.append({
+            'benchmark': name, 'W': W, 'L': L, 'p': p, 'distribution': distribution,
+            'n_nodes': len(G), 'permanent_shape': permanent_shape, 'n_sampled_nodes': n_sampled_nodes,
+            'seconds': seconds, 'calls_per_second': n_calls/seconds if seconds > 0 else None,
+            'peak_memory': peak_memory, 'seed': seed,
+        })
+    return rows
+
+# -------------------------------------------------------------------------
+# Ratio between the times of two runs of the suite
+# -------------------------------------------------------------------------
+# rows: Measurements of the current run
+# baseline: Measurements of a previous run, as written by run
+# -------------------------------------------------------------------------
+# Returns: A dictionary from (benchmark, W, L, p, distribution) to the ratio
+#          between the current and the previous time, for the entries
+#          present in both
+# -------------------------------------------------------------------------
+def compare(rows, baseline):
+    key = lambda row: (row['benchmark'], row['W'], row['L'], row['p'], row.get('distribution', 'geometric'))
+    previous = {key(row): row['seconds'] for row in baseline}
+    return {key(row): row['seconds']/previous[key(row)] for row in rows
+            if key(row) in previous and previous[key(row)] > 0}
+
+# -------------------------------------------------------------------------
+# Run the suite
+# -------------------------------------------------------------------------
+# Ws: Maximum out-degrees of the sweep
+# Ls: Numbers of levels of the sweep, each distribution stopping at the
+#     number of levels given by max_levels
+# ps: Sampling probabilities of the sweep
+# n_steps: Number of steps of the timed walks
+# n_proposals: Number of proposals of the timed proposal and acceptance calls
+# repeat: Number of timed calls of each function
+# seed: Base seed, the seed of each configuration is derived from it
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the environment and the list of measurements
+# -------------------------------------------------------------------------
+def run(Ws=(3, 10, 20), Ls=range(3, 13), ps=(0.2, 0.5, 0.8), n_steps=1000, n_proposals=100, repeat=3, seed=0):
+    rows = []
+    configurations = [(W, L, p, distribution, dist) for W in Ws for distribution, dist in benchmark_distributions(W)
+                      for L in Ls if L <= max_levels(dist) for p in ps]
+
+    print(f"{'benchmark':>26} {'dist':>9} {'W':>3} {'L':>3} {'p':>4} {'nodes':>7} {'time (s)':>10} {'calls/s':>10} "
+          f"{'peak (MB)':>10}")
+    for index, (W, L, p, distribution, dist) in enumerate(configurations):
+        for row in benchmark_configuration(W, L, p, distribution, dist, n_steps, n_proposals, repeat,
+                                           run_seed(seed, index, 0)):
+            rows.append(row)
+            print(f"{row['benchmark']:>26} {distribution:>9} {W:>3} {L:>3} {p:>4} {row['n_nodes']:>7} "
+                  f"{row['seconds']:10.5f} {row['calls_per_second']:10.1f} {row['peak_memory']/2**20:10.2f}")
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'parameters': {'n_steps': n_steps, 'n_proposals': n_proposals, 'repeat': repeat, 'seed': seed},
+        'results': rows,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark suite of the estimator')
+    parser.add_argument('--W', type=int, nargs='+', default=[3, 10, 20])
+    parser.add_argument('--L', type=int, nargs='+', default=list(range(3, 13)))
+    parser.add_argument('--p', type=float, nargs='+', default=[0.2, 0.5, 0.8])
+    parser.add_argument('--n-steps', type=int, default=1000)
+    parser.add_argument('--n-proposals', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results', 'suite.json'))
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare against')
+    args = parser.parse_args()
+
+    report = run(args.W, args.L, args.p, args.n_steps, args.n_proposals, args.repeat, args.seed)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            ratios = compare(report['results'], json.load(file)['results'])
+        for (name, W, L, p, distribution), ratio in sorted(ratios.items()):
+            print(f'{name:>26} {distribution:>9} {W:>3} {L:>3} {p:>4} {ratio:8.2f}x')
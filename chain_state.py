@@ -0,0 +1,299 @@
+# Description: State of the MCMC chain with its cached likelihood terms
+# Author: agent
+# Date: October 2026
+import time
+import numpy as np
+from compact_tree import as_compact_tree
+from instrumentation import profile
+from permanent import batch_log_permanent
+from sampling_model import log_offspring_weights
+from subtree_cache import CanonicalForms, LRUCache, canonical_ids
+
+# -------------------------------------------------------------------------
+# Quantities of the observed sample that do not change along the chain
+# -------------------------------------------------------------------------
+# The nodes of S are arranged by level: the map counts of a node g of G
+# are stored as a row whose i-th entry refers to the i-th node of S at
+# the depth of g. Rows only span the level of S they refer to, so the
+# table stays small when S is wide.
+#
+# The row of g only depends on the depth and on the shape of the subtree
+# of g, so rows are cached by the canonical identifier of the subtree.
+# Most subtrees are left untouched by a proposal, and the subtrees grown
+# by the add moves are mostly small shapes seen many times before.
+#
+# S: Sampled graph
+# n_sampled_nodes: Number of nodes sampled from G
+# p: Probability that a node from G is sampled into S
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children
+# cache_size: Maximum number of cached rows and of canonical forms
+# forms: CanonicalForms shared with other models (a new one if None), so
+#        that the subtrees of their chains are identified once
+# -------------------------------------------------------------------------
+class SampleModel:
+    def __init__(self, S, n_sampled_nodes, p, offspring_distribution, cache_size=2**16, forms=None):
+        S = as_compact_tree(S)
+        self.S = S
+        self.n_sampled_nodes = n_sampled_nodes
+        self.log_p = np.log(p)
+        self.log_1_minus_p = np.log1p(-p)
+        self.degree_weights = log_offspring_weights(offspring_distribution)
+
+        # Nodes of S at each level and the position of every node inside its level
+        self.levels = S.levels
+        position = np.empty(len(S), dtype=np.int64)
+        for level in self.levels:
+            position[level] = np.arange(len(level))
+
+        # Row of a leaf of G at each level: only the leaves of S can be mapped into it.
+        # The nodes of G deeper than S have an empty row.
+        self.leaf_rows = [np.where(S.out_degree[level] == 0, 0.0, -np.inf) for level in self.levels]
+        self.leaf_rows.append(np.empty(0))
+
+        self.forms = CanonicalForms(cache_size) if forms is None else forms
+        self.rows = LRUCache(cache_size)
+
+        # Internal nodes of S at each level grouped by number of children, keeping a
+        # single node per shape of subtree, since isomorphic subtrees of S have the
+        # same map counts. Each group holds the positions of the nodes that take the
+        # value of each representative and the positions of its children.
+        S_shape = canonical_ids(S, self.forms)
+        self.degree_groups = []
+        for level in self.levels:
+            groups = []
+            for k in np.unique(S.out_degree[level]):
+                if k == 0:
+                    continue
+                nodes = np.flatnonzero(S.out_degree[level] == k)
+                _, first, inverse = np.unique(S_shape[level[nodes]], return_index=True, return_inverse=True)
+                children = position[S.children[S.offsets[level[nodes[first]]][:, np.newaxis] + np.arange(k)]]
+                groups.append((nodes, inverse, children))
+            self.degree_groups.append(groups)
+
+    # -------------------------------------------------------------------------
+    # Log map counts between the subtrees of S and the subtree of G rooted at g
+    # -------------------------------------------------------------------------
+    # G: Tree of the chain
+    # log_maps: Table with the rows of the children of g already computed
+    # shape_ids: Canonical identifiers of the subtrees of G, the one of g is
+    #            set by this function
+    # g: Node of G
+    # -------------------------------------------------------------------------
+    # Returns: The row of g in the table of log map counts
+    # -------------------------------------------------------------------------
+    def node_log_maps(self, G, log_maps, shape_ids, g):
+        G_children = G.successors(g)
+        shape_ids[g] = self.forms.identify(shape_ids[G_children].tolist())
+
+        d = min(G.depth[g], len(self.levels))
+        if d == len(self.levels) or len(G_children) == 0:
+            return self.leaf_rows[d]
+
+        key = (d, shape_ids[g])
+        row = self.rows.get(key)
+        if row is None:
+            if profile.enabled:
+                start = time.perf_counter()
+
+            row = self.leaf_rows[d].copy()
+            children_rows = np.stack(log_maps[G_children])
+            for nodes, inverse, children in self.degree_groups[d]:
+                # One k x c matrix per representative, c being the number of children of g
+                row[nodes] = batch_log_permanent(children_rows[:, children].transpose(1, 2, 0))[inverse]
+                if profile.enabled:
+                    profile.matrix_shape(children.shape[1], len(G_children), len(children))
+            self.rows.put(key, row)
+
+            if profile.enabled:
+                profile.add_time('map_counting', time.perf_counter() - start)
+                profile.count('map_count_rows')
+        elif profile.enabled:
+            profile.count('map_count_cache_hits')
+
+        return row
+
+    # -------------------------------------------------------------------------
+    # Fill the rows of a set of nodes of G, children before parents
+    # -------------------------------------------------------------------------
+    # G: Tree of the chain
+    # log_maps: Table of log map counts, updated in place
+    # shape_ids: Canonical identifiers of the subtrees of G, updated in place
+    # nodes: Nodes to be updated, in decreasing order of label
+    # -------------------------------------------------------------------------
+    def fill_log_maps(self, G, log_maps, shape_ids, nodes):
+        for g in nodes:
+            log_maps[g] = self.node_log_maps(G, log_maps, shape_ids, g)
+
+    # -------------------------------------------------------------------------
+    # Usage statistics of the caches
+    # -------------------------------------------------------------------------
+    # Returns: A dictionary with the statistics of the cached rows and of the canonical forms
+    # -------------------------------------------------------------------------
+    def cache_stats(self):
+        return {'rows': self.rows.stats(), 'forms': self.forms.forms.stats()}
+
+
+# -------------------------------------------------------------------------
+# State of the chain
+# -------------------------------------------------------------------------
+# Besides the tree G_t, the state carries the terms of its likelihood so
+# that a proposal only recomputes what the move changes: the rows of the
+# new nodes and of the ancestors of the modified node in the table of log
+# map counts, and two entries of the out-degree histogram. It also keeps
+# the internal nodes of G_t, so that the proposals can pick one of them
+# and normalize their probabilities without scanning the tree.
+#
+# tree: Tree of the chain at time t
+# log_maps: Log of the number of maps between the subtrees of S and G_t,
+#           an object array with the row of every node of G_t
+# shape_ids: Canonical identifier of the subtree of every node of G_t
+# degree_count: Number of nodes of G_t with each out-degree
+# internal_nodes: Nodes of G_t with at least one child, in increasing order
+# model: The SampleModel shared by all the states of the chain
+# -------------------------------------------------------------------------
+class ChainState:
+    __slots__ = ('tree', 'log_maps', 'shape_ids', 'degree_count', 'internal_nodes', 'log_likelihood', 'model')
+
+    def __init__(self, tree, log_maps, shape_ids, degree_count, internal_nodes, model):
+        self.tree = tree
+        self.log_maps = log_maps
+        self.shape_ids = shape_ids
+        self.degree_count = degree_count
+        self.internal_nodes = internal_nodes
+        self.model = model
+
+        # log P(S | G_t) + log P(G_t)
+        log_sampling = (log_maps[0][0] + model.n_sampled_nodes * model.log_p
+                        + (len(tree) - model.n_sampled_nodes) * model.log_1_minus_p)
+        self.log_likelihood = log_sampling + degree_count @ model.degree_weights
+
+    # -------------------------------------------------------------------------
+    # Build the state of a tree from scratch
+    # -------------------------------------------------------------------------
+    # G: Tree of the chain
+    # S: Sampled graph
+    # n_sampled_nodes: Number of nodes sampled from G
+    # p: Probability that a node from G is sampled into S
+    # offspring_distribution: A list of probabilities that a node has 1, 2, ...
+    #                         children
+    # model: SampleModel of the previous arguments, built from them if None
+    # -------------------------------------------------------------------------
+    # Returns: The state of G
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_tree(cls, G, S, n_sampled_nodes, p, offspring_distribution, model=None):
+        G = as_compact_tree(G)
+        if model is None:
+            model = SampleModel(S, n_sampled_nodes, p, offspring_distribution)
+
+        log_maps = np.empty(len(G), dtype=object)
+        shape_ids = np.empty(len(G), dtype=np.int64)
+        model.fill_log_maps(G, log_maps, shape_ids, range(len(G) - 1, -1, -1))
+
+        return cls(G, log_maps, shape_ids, _degree_count(G, model), G.internal_nodes, model)
+
+    def __len__(self):
+        return len(self.tree)
+
+    # -------------------------------------------------------------------------
+    # Recompute the rows of a node and its ancestors
+    # -------------------------------------------------------------------------
+    def _update_path(self, G, log_maps, shape_ids, v):
+        while v >= 0:
+            log_maps[v] = self.model.node_log_maps(G, log_maps, shape_ids, v)
+            v = G.parent[v]
+
+    # -------------------------------------------------------------------------
+    # Attach a tree as a new child of v
+    # -------------------------------------------------------------------------
+    # v: Node that receives the new child
+    # T: Tree to be attached
+    # -------------------------------------------------------------------------
+    # Returns: The state of the tree with T attached under v
+    # -------------------------------------------------------------------------
+    def attach(self, v, T):
+        G = self.tree.attach(v, T)
+
+        log_maps = np.empty(len(G), dtype=object)
+        log_maps[:len(self.tree)] = self.log_maps
+        shape_ids = np.empty(len(G), dtype=np.int64)
+        shape_ids[:len(self.tree)] = self.shape_ids
+        self.model.fill_log_maps(G, log_maps, shape_ids, range(len(G) - 1, len(self.tree) - 1, -1))
+        self._update_path(G, log_maps, shape_ids, v)
+
+        degree_count = self.degree_count + _degree_count(T, self.model)
+        d = self.tree.out_degree[v]
+        degree_count[d] -= 1
+        degree_count[d + 1] += 1
+
+        # The new nodes have the largest labels, which keeps the internal nodes sorted
+        internal_nodes = self.internal_nodes
+        if d == 0:
+            internal_nodes = np.insert(internal_nodes, np.searchsorted(internal_nodes, v), v)
+        internal_nodes = np.concatenate([internal_nodes, T.internal_nodes + len(self.tree)])
+
+        return ChainState(G, log_maps, shape_ids, degree_count, internal_nodes, self.model)
+
+    # -------------------------------------------------------------------------
+    # Remove the subtree rooted at u
+    # -------------------------------------------------------------------------
+    # u: Root of the subtree to be removed
+    # -------------------------------------------------------------------------
+    # Returns: The state of the tree without u and its descendants
+    # -------------------------------------------------------------------------
+    def remove_subtree(self, u):
+        removed = self.tree.subtree_mask(u)
+        G = self.tree.induced_subtree(~removed)
+        new_label = np.cumsum(~removed) - 1
+
+        # The descendants of u have larger labels than u, so the parent v of u keeps its label
+        log_maps = self.log_maps[~removed]
+        shape_ids = self.shape_ids[~removed]
+        v = self.tree.parent[u]
+        self._update_path(G, log_maps, shape_ids, v)
+
+        degree_count = self.degree_count - np.bincount(self.tree.out_degree[removed],
+                                                       minlength=len(self.degree_count))
+        d = self.tree.out_degree[v]
+        degree_count[d] -= 1
+        degree_count[d - 1] += 1
+
+        internal_nodes = self.internal_nodes[~removed[self.internal_nodes]]
+        if d == 1:
+            internal_nodes = internal_nodes[internal_nodes != v]
+        internal_nodes = new_label[internal_nodes]
+
+        return ChainState(G, log_maps, shape_ids, degree_count, internal_nodes, self.model)
+
+    # -------------------------------------------------------------------------
+    # Access to the tree of the state
+    # -------------------------------------------------------------------------
+    @property
+    def out_degree(self):
+        return self.tree.out_degree
+
+    @property
+    def depth(self):
+        return self.tree.depth
+
+    @property
+    def n_leaves(self):
+        return int(self.degree_count[0])
+
+    @property
+    def n_internal(self):
+        return len(self.internal_nodes)
+
+    def successors(self, v):
+        return self.tree.successors(v)
+
+    def subtree(self, v):
+        return self.tree.subtree(v)
+
+
+# -------------------------------------------------------------------------
+# Out-degree histogram of a tree
+# -------------------------------------------------------------------------
+def _degree_count(G, model):
+    return np.bincount(G.out_degree, minlength=len(model.degree_weights))
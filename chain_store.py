@@ -0,0 +1,162 @@
+# Description: Columnar on-disk storage of the states of MCMC chains
+# Author: agent
+# Date: October 2026
+import hashlib
+import json
+import os
+import numpy as np
+from reducers import Reducer, merge_offspring_counts
+from sampling_model import degree_count_to_offspring_count
+
+# Columns of a stored chain: name, dtype and whether it has one entry per out-degree
+COLUMNS = (
+    ('degree_count', np.int64, True),
+    ('tree_size', np.int64, False),
+    ('accepted', np.int8, False),
+    ('log_likelihood', np.float64, False),
+)
+
+# -------------------------------------------------------------------------
+# Digest of the configuration of a chain or of a run
+# -------------------------------------------------------------------------
+# configuration: JSON serializable arguments (for instance the arguments of
+#                experiment.experiment)
+# -------------------------------------------------------------------------
+# Returns: A hexadecimal digest of 16 characters
+# -------------------------------------------------------------------------
+def configuration_digest(configuration):
+    return hashlib.sha1(json.dumps(configuration, default=float).encode()).hexdigest()[:16]
+
+# -------------------------------------------------------------------------
+# Directory of a chain inside a store
+# -------------------------------------------------------------------------
+# Chains are keyed by a hash of their configuration and by their seed, so
+# a chain can be found again from the arguments that generated it.
+# -------------------------------------------------------------------------
+# store_dir: Root directory of the store
+# configuration: JSON serializable arguments of the chain (for instance
+#                the arguments of experiment.experiment)
+# seed: Seed of the chain
+# -------------------------------------------------------------------------
+# Returns: The path of the directory of the chain
+# -------------------------------------------------------------------------
+def chain_path(store_dir, configuration, seed):
+    return os.path.join(store_dir, configuration_digest(configuration), f'seed_{seed}')
+
+# -------------------------------------------------------------------------
+# Write the metadata of a chain atomically
+# -------------------------------------------------------------------------
+def _write_metadata(path, metadata):
+    tmp_path = os.path.join(path, 'metadata.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(metadata, file)
+    os.replace(tmp_path, os.path.join(path, 'metadata.json'))
+
+# -------------------------------------------------------------------------
+# Reducer that appends the states of a chain to a store
+# -------------------------------------------------------------------------
+# Every column is a raw binary file to which the states are appended in
+# blocks of flush_every states, and metadata.json holds the dtypes, the
+# row shapes and the number of states written so far. Unlike .npy files,
+# whose header fixes the length, the columns can grow as the chain runs
+# and still be opened with np.memmap at any time. An existing chain at
+# the same path is overwritten.
+#
+# The accepted column holds 1 for accepted proposals, 0 for rejected ones
+# and -1 for the initial state.
+# -------------------------------------------------------------------------
+# path: Directory of the chain (see chain_path)
+# configuration: Arguments of the chain, stored in the metadata
+# seed: Seed of the chain, stored in the metadata
+# flush_every: Number of states kept in memory between two writes
+# -------------------------------------------------------------------------
+# Returns: The path of the stored chain
+# -------------------------------------------------------------------------
+class ChainStore(Reducer):
+    def __init__(self, path, configuration=None, seed=None, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = {name: [] for name, _, _ in COLUMNS}
+        self.metadata = {'configuration': configuration, 'seed': seed, 'n_states': 0, 'width': None,
+                         'columns': {name: np.dtype(dtype).str for name, dtype, _ in COLUMNS}}
+
+        os.makedirs(path, exist_ok=True)
+        for name, _, _ in COLUMNS:
+            open(os.path.join(path, f'{name}.bin'), 'wb').close()
+        _write_metadata(path, self.metadata)
+
+    def update(self, state, accepted):
+        self.buffer['degree_count'].append(state.degree_count)
+        self.buffer['tree_size'].append(len(state))
+        self.buffer['accepted'].append(-1 if accepted is None else int(accepted))
+        self.buffer['log_likelihood'].append(state.log_likelihood)
+        if len(self.buffer['tree_size']) >= self.flush_every:
+            self.flush()
+
+    # -------------------------------------------------------------------------
+    # Append the buffered states to the columns
+    # -------------------------------------------------------------------------
+    def flush(self):
+        n_buffered = len(self.buffer['tree_size'])
+        if n_buffered == 0:
+            return
+
+        self.metadata['width'] = len(self.buffer['degree_count'][0])
+        for name, dtype, _ in COLUMNS:
+            with open(os.path.join(self.path, f'{name}.bin'), 'ab') as file:
+                file.write(np.asarray(self.buffer[name], dtype=dtype).tobytes())
+            self.buffer[name] = []
+
+        self.metadata['n_states'] += n_buffered
+        _write_metadata(self.path, self.metadata)
+
+    def result(self):
+        self.flush()
+        return self.path
+
+
+# -------------------------------------------------------------------------
+# Open a stored chain
+# -------------------------------------------------------------------------
+# The columns are memory-mapped, so only the parts that are read are
+# loaded into memory. Only the states recorded in the metadata are
+# exposed, even if the chain is still being written.
+# -------------------------------------------------------------------------
+# path: Directory of the chain
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the metadata and a read-only array per column
+# -------------------------------------------------------------------------
+def load_chain(path):
+    with open(os.path.join(path, 'metadata.json')) as file:
+        metadata = json.load(file)
+
+    n_states = metadata['n_states']
+    chain = {'metadata': metadata}
+    for name, _, per_degree in COLUMNS:
+        shape = (n_states, metadata['width']) if per_degree else (n_states,)
+        dtype = np.dtype(metadata['columns'][name])
+        if n_states == 0:
+            chain[name] = np.empty((0, metadata['width'] or 0) if per_degree else (0,), dtype=dtype)
+        else:
+            chain[name] = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r', shape=shape)
+    return chain
+
+# -------------------------------------------------------------------------
+# Sufficient statistics of the EM algorithm from a stored chain
+# -------------------------------------------------------------------------
+# The degree histograms are read in blocks, so the whole chain is never
+# held in memory.
+# -------------------------------------------------------------------------
+# path: Directory of the chain
+# block_size: Number of states read at once
+# -------------------------------------------------------------------------
+# Returns: The distinct offspring counts of the states and the number of
+#          states with each of them, as returned by reducers.OffspringCounts
+# -------------------------------------------------------------------------
+def stored_offspring_counts(path, block_size=2**16):
+    degree_count = load_chain(path)['degree_count']
+
+    blocks = (np.unique(degree_count_to_offspring_count(np.asarray(degree_count[start:start + block_size])),
+                        axis=0, return_counts=True)
+              for start in range(0, len(degree_count), block_size))
+    return merge_offspring_counts(blocks)
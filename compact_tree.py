@@ -0,0 +1,276 @@
+# Description: Compact array-backed representation of rooted trees
+# Author: agent
+# Date: October 2026
+import networkx as nx
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Rooted tree stored as NumPy arrays
+# -------------------------------------------------------------------------
+# Nodes are labelled 0, 1, ..., n-1 with the root at 0 and every node
+# labelled after its parent (parent[v] < v), so iterating the labels in
+# reverse order always visits children before their parents.
+#
+# parent: Parent of each node (-1 for the root)
+# out_degree: Number of children of each node
+# offsets: CSR offsets, the children of v are children[offsets[v]:offsets[v+1]]
+# children: Children of every node, grouped by parent
+# depth: Distance of each node to the root
+# -------------------------------------------------------------------------
+class CompactTree:
+    __slots__ = ('parent', 'out_degree', 'offsets', 'children', 'depth', '_subtree_size', '_levels')
+
+    def __init__(self, parent):
+        parent = np.asarray(parent, dtype=np.int64)
+        n_nodes = len(parent)
+
+        self.parent = parent
+        self.out_degree = np.bincount(parent[1:], minlength=n_nodes)
+
+        # CSR layout of the children lists
+        self.offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(self.out_degree, out=self.offsets[1:])
+        self.children = np.argsort(parent[1:], kind='stable') + 1
+
+        # Depth of every node, climbing one level at a time
+        self.depth = np.zeros(n_nodes, dtype=np.int64)
+        ancestor = parent.copy()
+        while True:
+            has_ancestor = ancestor >= 0
+            if not has_ancestor.any():
+                break
+            self.depth += has_ancestor
+            ancestor[has_ancestor] = parent[ancestor[has_ancestor]]
+
+        self._subtree_size = None
+        self._levels = None
+
+    # -------------------------------------------------------------------------
+    # Build a tree from arrays that are already consistent with each other
+    # -------------------------------------------------------------------------
+    # Used by the edits of a tree, which derive the new arrays from the old
+    # ones instead of sorting the children and climbing the depths again.
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _from_arrays(cls, parent, out_degree, offsets, children, depth):
+        tree = cls.__new__(cls)
+        tree.parent = parent
+        tree.out_degree = out_degree
+        tree.offsets = offsets
+        tree.children = children
+        tree.depth = depth
+        tree._subtree_size = None
+        tree._levels = None
+        return tree
+
+    def __len__(self):
+        return len(self.parent)
+
+    # -------------------------------------------------------------------------
+    # Number of nodes in the subtree rooted at each node
+    # -------------------------------------------------------------------------
+    @property
+    def subtree_size(self):
+        if self._subtree_size is None:
+            size = np.ones(len(self), dtype=np.int64)
+            for nodes in reversed(self.levels[1:]):
+                np.add.at(size, self.parent[nodes], size[nodes])
+            self._subtree_size = size
+        return self._subtree_size
+
+    # -------------------------------------------------------------------------
+    # Nodes at each depth of the tree
+    # -------------------------------------------------------------------------
+    # Returns: A list whose d-th entry is the array of nodes at depth d, in
+    #          increasing order of label
+    # -------------------------------------------------------------------------
+    @property
+    def levels(self):
+        if self._levels is None:
+            order = np.argsort(self.depth, kind='stable')
+            self._levels = np.split(order, np.cumsum(np.bincount(self.depth))[:-1])
+        return self._levels
+
+    # -------------------------------------------------------------------------
+    # Depth of the deepest node of the tree
+    # -------------------------------------------------------------------------
+    @property
+    def height(self):
+        return int(self.depth.max())
+
+    # -------------------------------------------------------------------------
+    # Number of leaves of the tree
+    # -------------------------------------------------------------------------
+    @property
+    def n_leaves(self):
+        return int(np.count_nonzero(self.out_degree == 0))
+
+    # -------------------------------------------------------------------------
+    # Nodes with at least one child, in increasing order of label
+    # -------------------------------------------------------------------------
+    @property
+    def internal_nodes(self):
+        return np.flatnonzero(self.out_degree > 0)
+
+    # -------------------------------------------------------------------------
+    # Number of nodes with at least one child
+    # -------------------------------------------------------------------------
+    @property
+    def n_internal(self):
+        return len(self) - self.n_leaves
+
+    # -------------------------------------------------------------------------
+    # Children of a node
+    # -------------------------------------------------------------------------
+    # v: Node
+    # -------------------------------------------------------------------------
+    # Returns: An array with the children of v
+    # -------------------------------------------------------------------------
+    def successors(self, v):
+        return self.children[self.offsets[v]:self.offsets[v + 1]]
+
+    # -------------------------------------------------------------------------
+    # Nodes of the subtree rooted at v
+    # -------------------------------------------------------------------------
+    # The subtree is explored level by level, gathering the CSR segments of
+    # the children of a whole level at once, so the cost is proportional to
+    # the size of the subtree.
+    # -------------------------------------------------------------------------
+    # v: Root of the subtree
+    # -------------------------------------------------------------------------
+    # Returns: An array with v and all of its descendants
+    # -------------------------------------------------------------------------
+    def subtree_nodes(self, v):
+        frontier = np.array([v], dtype=np.int64)
+        nodes = [frontier]
+        while True:
+            n_children = self.out_degree[frontier]
+            total = n_children.sum()
+            if total == 0:
+                break
+            # Position of every child of the frontier in the children array
+            segment_starts = np.repeat(self.offsets[frontier] - np.cumsum(n_children) + n_children, n_children)
+            frontier = self.children[segment_starts + np.arange(total)]
+            nodes.append(frontier)
+        return np.concatenate(nodes)
+
+    # -------------------------------------------------------------------------
+    # Boolean mask of the nodes in the subtree rooted at v
+    # -------------------------------------------------------------------------
+    # v: Root of the subtree
+    # -------------------------------------------------------------------------
+    # Returns: A boolean array, True for v and all of its descendants
+    # -------------------------------------------------------------------------
+    def subtree_mask(self, v):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.subtree_nodes(v)] = True
+        return mask
+
+    # -------------------------------------------------------------------------
+    # Keep only the nodes selected by a mask
+    # -------------------------------------------------------------------------
+    # mask: Boolean array selecting a connected set of nodes containing a root
+    # -------------------------------------------------------------------------
+    # Returns: The induced tree, relabelled preserving the order of the nodes
+    # -------------------------------------------------------------------------
+    def induced_subtree(self, mask):
+        new_label = np.cumsum(mask) - 1
+        parent = self.parent[mask]
+        kept_parent = (parent >= 0) & mask[np.maximum(parent, 0)]
+        parent = np.where(kept_parent, new_label[np.maximum(parent, 0)], -1)
+
+        # The relabelling preserves the order of the nodes, so the kept entries of
+        # the children lists stay grouped by parent and sorted
+        kept_children = self.children[mask[self.children] & mask[self.parent[self.children]]]
+        out_degree = np.bincount(parent[1:], minlength=len(parent))
+        offsets = np.zeros(len(parent) + 1, dtype=np.int64)
+        np.cumsum(out_degree, out=offsets[1:])
+
+        depth = self.depth[mask]
+        return CompactTree._from_arrays(parent, out_degree, offsets, new_label[kept_children], depth - depth[0])
+
+    # -------------------------------------------------------------------------
+    # Subtree rooted at v
+    # -------------------------------------------------------------------------
+    # v: Root of the subtree
+    # -------------------------------------------------------------------------
+    # Returns: The subtree rooted at v as a new tree
+    # -------------------------------------------------------------------------
+    def subtree(self, v):
+        return self.induced_subtree(self.subtree_mask(v))
+
+    # -------------------------------------------------------------------------
+    # Remove the subtree rooted at v
+    # -------------------------------------------------------------------------
+    # v: Root of the subtree to be removed
+    # -------------------------------------------------------------------------
+    # Returns: A new tree without v and its descendants
+    # -------------------------------------------------------------------------
+    def remove_subtree(self, v):
+        return self.induced_subtree(~self.subtree_mask(v))
+
+    # -------------------------------------------------------------------------
+    # Attach a tree as a new child of v
+    # -------------------------------------------------------------------------
+    # v: Node that receives the new child
+    # T: Tree to be attached, its root becomes a child of v
+    # -------------------------------------------------------------------------
+    # Returns: A new tree with the nodes of T appended after the nodes of self
+    # -------------------------------------------------------------------------
+    def attach(self, v, T):
+        n_nodes = len(self)
+        T_parent = T.parent + n_nodes
+        T_parent[0] = v
+        parent = np.concatenate([self.parent, T_parent])
+
+        out_degree = np.concatenate([self.out_degree, T.out_degree])
+        out_degree[v] += 1
+
+        # The root of T closes the children list of v, and the lists of the nodes
+        # of T go after every list of self since their labels are the largest
+        end = self.offsets[v + 1]
+        offsets = np.concatenate([self.offsets[:v + 1], self.offsets[v + 1:] + 1, T.offsets[1:] + self.offsets[-1] + 1])
+        children = np.concatenate([self.children[:end], [n_nodes], self.children[end:], T.children + n_nodes])
+
+        depth = np.concatenate([self.depth, T.depth + self.depth[v] + 1])
+        return CompactTree._from_arrays(parent, out_degree, offsets, children, depth)
+
+    # -------------------------------------------------------------------------
+    # Convert the tree into a networkx directed graph
+    # -------------------------------------------------------------------------
+    def to_networkx(self):
+        G = nx.DiGraph()
+        G.add_nodes_from(range(len(self)))
+        nodes = np.arange(1, len(self))
+        G.add_edges_from(zip(self.parent[1:].tolist(), nodes.tolist()))
+        return G
+
+    # -------------------------------------------------------------------------
+    # Build a tree from a networkx directed graph
+    # -------------------------------------------------------------------------
+    # G: Directed tree with edges pointing from parents to children
+    # root: Root of G
+    # -------------------------------------------------------------------------
+    # Returns: The tree with nodes relabelled in breadth-first order
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_networkx(cls, G, root=0):
+        order = [root] + [v for _, v in nx.bfs_edges(G, root)]
+        label = {node: i for i, node in enumerate(order)}
+        parent = np.full(len(order), -1, dtype=np.int64)
+        for u, v in nx.bfs_edges(G, root):
+            parent[label[v]] = label[u]
+        return cls(parent)
+
+
+# -------------------------------------------------------------------------
+# Make sure a tree is stored as a CompactTree
+# -------------------------------------------------------------------------
+# G: A CompactTree or a networkx directed tree rooted at 0
+# -------------------------------------------------------------------------
+# Returns: G as a CompactTree
+# -------------------------------------------------------------------------
+def as_compact_tree(G):
+    if isinstance(G, CompactTree):
+        return G
+    return CompactTree.from_networkx(G)
@@ -0,0 +1,79 @@
+# Description: Convergence diagnostics for the MCMC chains
+# Author: agent
+# Date: October 2026
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Gelman-Rubin potential scale reduction factor
+# -------------------------------------------------------------------------
+# traces: Array of shape (n_chains, n_states, n_statistics) with the value
+#         of each statistic at every state of every chain
+# -------------------------------------------------------------------------
+# Returns: The R-hat of each statistic (nan for statistics that never vary)
+# -------------------------------------------------------------------------
+def gelman_rubin(traces):
+    traces = np.asarray(traces, dtype=np.float64)
+    n_chains, n_states, _ = traces.shape
+
+    # Between-chain and within-chain variances
+    between = n_states * traces.mean(axis=1).var(axis=0, ddof=1)
+    within = traces.var(axis=1, ddof=1).mean(axis=0)
+
+    pooled = (n_states - 1)/n_states * within + between/n_states
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(pooled/within)
+
+# -------------------------------------------------------------------------
+# Autocovariance of every chain and statistic
+# -------------------------------------------------------------------------
+# traces: Array of shape (n_chains, n_states, n_statistics)
+# -------------------------------------------------------------------------
+# Returns: Array of the same shape with the autocovariance at each lag
+# -------------------------------------------------------------------------
+def _autocovariance(traces):
+    n_states = traces.shape[1]
+    centered = traces - traces.mean(axis=1, keepdims=True)
+
+    # Zero padding avoids the circular correlation of the FFT
+    size = 1 << (2*n_states - 1).bit_length()
+    transform = np.fft.rfft(centered, n=size, axis=1)
+    return np.fft.irfft(transform * np.conj(transform), n=size, axis=1)[:, :n_states]/n_states
+
+# -------------------------------------------------------------------------
+# Effective sample size of a set of chains
+# -------------------------------------------------------------------------
+# The autocorrelations of the chains are combined as in Gelman et al.
+# (Bayesian Data Analysis, 3rd edition) and summed up to the first
+# negative pair of consecutive lags, with Geyer's monotone correction.
+# -------------------------------------------------------------------------
+# traces: Array of shape (n_chains, n_states, n_statistics)
+# -------------------------------------------------------------------------
+# Returns: The effective sample size of each statistic (nan for statistics that never vary)
+# -------------------------------------------------------------------------
+def effective_sample_size(traces):
+    traces = np.asarray(traces, dtype=np.float64)
+    n_chains, n_states, n_statistics = traces.shape
+
+    autocovariance = _autocovariance(traces)
+    within = autocovariance[:, 0].mean(axis=0) * n_states/(n_states - 1)
+    pooled = (n_states - 1)/n_states * within
+    if n_chains > 1:
+        pooled += traces.mean(axis=1).var(axis=0, ddof=1)
+
+    ess = np.full(n_statistics, np.nan)
+    for k in range(n_statistics):
+        if pooled[k] <= 0:
+            continue
+        rho = 1 - (within[k] - autocovariance[:, :, k].mean(axis=0))/pooled[k]
+        rho[0] = 1
+
+        # Sums of consecutive pairs of autocorrelations, truncated at the first negative one
+        pairs = rho[:n_states - n_states % 2].reshape(-1, 2).sum(axis=1)
+        negative = np.flatnonzero(pairs < 0)
+        pairs = pairs[:negative[0]] if len(negative) > 0 else pairs
+        pairs = np.minimum.accumulate(pairs)
+
+        tau = -1 + 2*pairs.sum()
+        ess[k] = n_chains*n_states/max(tau, 1/np.log10(n_chains*n_states))
+
+    return ess
@@ -1,9 +1,15 @@
 # Definition of the experiment.
 # Author: Ronald Albert
 # Date: June 2023
-from sampling_model import galton_watson, sample
+from sampling_model import galton_watson, galton_watson_forest, sample
 from graph_mcmc import mcmc_walk
 from optimization import optimized_distribution
+from reducers import OffspringCounts, make_stopping
+from multi_chain import run_chains
+from monte_carlo_em import monte_carlo_em
+from batch_inference import batch_monte_carlo_em
+from instrumentation import timed
+from seeding import seed_process
 import numpy as np
 
 # -------------------------------------------------------------------------
@@ -26,19 +32,140 @@ def kl_divergence(p, q):
 # W: Maximum value of the offspring distribution
 # L: Maximum number of levels in the tree
 # p: Probability of sampling a path from the Galton-Watson process
-# n_steps: Number of steps in the walk
+# n_steps: Number of steps in the walk, or the maximum number of steps if
+#          the walk stops adaptively
+# burn_in: Number of initial states of the walk that are discarded
+# thinning: Keep one state of the walk every thinning steps
+# target_ess: If given, the walk stops once the offspring frequencies reach
+#             this effective sample size
+# target_se: If given, the walk stops once the standard errors of the
+#            offspring frequencies are below this value
+# chain_store: If given, a chain_store.ChainStore where the states of the walk are written
+# n_tries: Number of candidates of each step of the walk (see
+#          graph_mcmc.multiple_try_transition)
 # -------------------------------------------------------------------------
 # Returns: The estimated distribution
 # -------------------------------------------------------------------------
-def experiment(offspring_distribution, dist_g, W, L, p, n_steps):
+def experiment(offspring_distribution, dist_g, W, L, p, n_steps, burn_in=0, thinning=1, target_ess=None, target_se=None,
+               chain_store=None, n_tries=1):
+    G = timed('generation', galton_watson, offspring_distribution, L)
+
+    S, n_nodes = timed('sampling', sample, G, p)
+
+    stopping = make_stopping(target_ess, target_se)
+
+    # The walk is folded into the sufficient statistics of the EM algorithm as it runs
+    reducers = [OffspringCounts()] if chain_store is None else [OffspringCounts(), chain_store]
+    (counts, multiplicity), *_ = timed('walk', mcmc_walk, G, S, n_nodes, W, L, dist_g, p, n_steps, burn_in, thinning,
+                                       reducers=reducers, stopping=stopping, n_tries=n_tries)
+
+    theta = timed('optimization', optimized_distribution, counts, dist_g, multiplicity)
+
+    return kl_divergence(theta, offspring_distribution), theta
+
+
+# -------------------------------------------------------------------------
+# Run the experiment with several independent chains
+# -------------------------------------------------------------------------
+# offspring_distribution: The offspring distribution
+# dist_g: Distribution for the MCMC algorithm
+# W: Maximum value of the offspring distribution
+# L: Maximum number of levels in the tree
+# p: Probability of sampling a path from the Galton-Watson process
+# n_steps: Number of steps in each walk
+# n_chains: Number of chains, run in a process pool
+# initial: How the chains are started (see multi_chain.run_chains)
+# burn_in: Number of initial states of each walk that are discarded
+# thinning: Keep one state of each walk every thinning steps
+# seed: Seed of the tree, of its sample and of the chains (the current
+#       random state if None)
+# n_processes: Number of processes of the pool (one per core if None)
+# -------------------------------------------------------------------------
+# Returns: The Kullback-Leibler divergence, the estimated distribution and
+#          the convergence diagnostics of the chains
+# -------------------------------------------------------------------------
+def multi_chain_experiment(offspring_distribution, dist_g, W, L, p, n_steps, n_chains,
+                           initial='dispersed', burn_in=0, thinning=1, seed=None, n_processes=None):
+    if seed is not None:
+        seed_process(seed)
+
     G = galton_watson(offspring_distribution, L)
 
     S, n_nodes = sample(G, p)
 
-    sampled_graphs = mcmc_walk(G, S, n_nodes, W, L, dist_g, p, n_steps)
+    chains = run_chains(S, n_nodes, W, L, dist_g, p, n_steps, n_chains, initial, burn_in, thinning, seed, n_processes)
 
-    theta = optimized_distribution(sampled_graphs, dist_g)
+    theta = optimized_distribution(chains['counts'], dist_g, chains['multiplicity'])
 
-    return kl_divergence(theta, offspring_distribution), theta
+    diagnostics = {key: chains[key] for key in ('r_hat', 'ess', 'acceptance_rate')}
+
+    return kl_divergence(theta, offspring_distribution), theta, diagnostics
+
+
+# -------------------------------------------------------------------------
+# Run the experiment with the Monte Carlo EM algorithm
+# -------------------------------------------------------------------------
+# offspring_distribution: The offspring distribution
+# dist_g: Initial distribution of the EM algorithm
+# W: Maximum value of the offspring distribution
+# L: Maximum number of levels in the tree
+# p: Probability of sampling a path from the Galton-Watson process
+# n_steps: Number of steps of each walk
+# max_iterations: Maximum number of EM iterations
+# tolerance: Largest change of the estimate for the iterations to stop
+# min_ess_fraction: Fraction of the states under which a new walk is run
+# burn_in: Number of initial states of the first walk that are discarded
+# thinning: Keep one state of each walk every thinning steps
+# target_ess: If given, each walk stops once the offspring frequencies
+#             reach this effective sample size
+# target_se: If given, each walk stops once the standard errors of the
+#            offspring frequencies are below this value
+# -------------------------------------------------------------------------
+# Returns: The Kullback-Leibler divergence, the estimated distribution and
+#          the history of the EM iterations
+# -------------------------------------------------------------------------
+def em_experiment(offspring_distribution, dist_g, W, L, p, n_steps, max_iterations=20, tolerance=1e-3,
+                  min_ess_fraction=0.5, burn_in=0, thinning=1, target_ess=None, target_se=None):
+    G = timed('generation', galton_watson, offspring_distribution, L)
+
+    S, n_nodes = timed('sampling', sample, G, p)
+
+    theta, history = monte_carlo_em(G, S, n_nodes, W, L, p, dist_g, n_steps, max_iterations, tolerance,
+                                    min_ess_fraction, burn_in, thinning, target_ess, target_se)
+
+    return kl_divergence(theta, offspring_distribution), theta, history
+
+
+# -------------------------------------------------------------------------
+# Run the experiment on a batch of independent observations
+# -------------------------------------------------------------------------
+# offspring_distribution: The offspring distribution
+# dist_g: Initial distribution of the EM algorithm
+# W: Maximum value of the offspring distribution
+# L: Maximum number of levels in the trees
+# p: Probability of sampling a path from the Galton-Watson process
+# n_observations: Number of hidden trees, each sampled once
+# n_steps: Number of steps of each walk
+# max_iterations: Maximum number of EM iterations
+# tolerance: Largest change of the estimate for the iterations to stop
+# burn_in: Number of initial states of the first walk of each observation that are discarded
+# seed: Seed of the trees and of their samples, from which the seeds of the
+#       walks are also derived (the current random state if None)
+# n_processes: Number of processes of the pool (one per core if None)
+# -------------------------------------------------------------------------
+# Returns: The Kullback-Leibler divergence, the estimated distribution and
+#          the history of the EM iterations
+# -------------------------------------------------------------------------
+def batch_experiment(offspring_distribution, dist_g, W, L, p, n_observations, n_steps, max_iterations=20,
+                     tolerance=1e-3, burn_in=0, seed=None, n_processes=None):
+    if seed is not None:
+        seed_process(seed)
+
+    trees = timed('generation', galton_watson_forest, offspring_distribution, L, n_observations)
+
+    observations = timed('sampling', lambda: [sample(G, p) for G in trees])
+
+    theta, history = timed('walk', batch_monte_carlo_em, observations, W, L, p, dist_g, n_steps, max_iterations,
+                           tolerance, burn_in=burn_in, seed=seed, n_processes=n_processes)
 
-    
+    return kl_divergence(theta, offspring_distribution), theta, history
@@ -1,12 +1,22 @@
 # Description: This file contains the functions for the MCMC algorithm
 # Author: Ronald Albert
 # Date: June 2023
-import networkx as nx
 import random
-from sampling_model import sampling_probability, galton_watson_probability,galton_watson, remove_tree
+import time
+import numpy as np
+from scipy.special import logsumexp
+from chain_state import ChainState
+from compact_tree import as_compact_tree
+from instrumentation import profile
+from reducers import StateCollector
+from sampling_model import log_sampling_probability, log_galton_watson_probability, galton_watson, remove_tree
 
 # -------------------------------------------------------------------------
-# Generating walk of length n_steps from initial_graph
+# Generate the states of a walk of length n_steps from initial_graph
+# -------------------------------------------------------------------------
+# The states are produced one at a time, so the walk never has to be held
+# in memory. The initial graph is the state at time 0 and the state at
+# time t is kept if t >= burn_in and (t - burn_in) is a multiple of thinning.
 # -------------------------------------------------------------------------
 # initial_graph: Graph at time 0
 # S: Sampled path from Galsont-Watson process
@@ -15,26 +25,109 @@ from sampling_model import sampling_probability, galton_watson_probability,galto
 # offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
 # p: Probability of sampling a path from Galsont-Watson process
 # n_steps: Number of steps in the walk
+# burn_in: Number of initial states that are discarded
+# thinning: Keep one state every thinning steps
+# n_tries: Number of candidates of each step. With more than one, the steps
+#          follow the multiple-try Metropolis rule (see multiple_try_transition)
+# model: chain_state.SampleModel of S, for instance one whose caches are
+#        shared with other chains (built from the arguments if None)
 # -------------------------------------------------------------------------
-# Returns: A walk of length n_steps from initial_graph
+# Returns: A generator of pairs (G_t, accepted) with the kept ChainStates and
+#          whether the proposal leading to them was accepted (None at time 0)
 # -------------------------------------------------------------------------
-def mcmc_walk(initial_graph, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps):
-    G_t = initial_graph
-    walk = [G_t]
-    for _ in range(n_steps):
-        # Generate proposal G_t+1 from G_t
-        G_t_plus_1,  prob_from_G_t, prob_from_G_t_plus_1 = proposal_transition(G_t, W, L, offspring_distribution)
-        # Calculate acceptance probability of G_t+1 from G_t
-        accept_prob = acceptance_function(S, n_sampled_nodes, G_t, G_t_plus_1, p, offspring_distribution, prob_from_G_t, prob_from_G_t_plus_1)
+def mcmc_chain(initial_graph, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, burn_in=0, thinning=1,
+               n_tries=1, model=None):
+    G_t = ChainState.from_tree(initial_graph, S, n_sampled_nodes, p, offspring_distribution, model)
+    if burn_in == 0:
+        yield G_t, None
+
+    for t in range(1, n_steps + 1):
+        if profile.enabled:
+            start = time.perf_counter()
+
+        if n_tries > 1:
+            # Draw the candidates and the reference trees and select one of the candidates
+            G_t_plus_1, accept_prob = multiple_try_transition(G_t, W, L, offspring_distribution, n_tries)
+
+            if profile.enabled:
+                proposed = time.perf_counter()
+                profile.add_time('multiple_try', proposed - start)
+        else:
+            # Generate proposal G_t+1 from G_t
+            G_t_plus_1,  log_prob_from_G_t, log_prob_from_G_t_plus_1 = proposal_transition(G_t, W, L, offspring_distribution)
+
+            if profile.enabled:
+                proposed = time.perf_counter()
+                profile.add_time('proposal', proposed - start)
+
+            # Calculate acceptance probability of G_t+1 from G_t
+            accept_prob = acceptance_function(S, n_sampled_nodes, G_t, G_t_plus_1, p, offspring_distribution, log_prob_from_G_t, log_prob_from_G_t_plus_1)
 
         # Decide whether to accept G_t+1
         u = random.random()
-        if u < accept_prob:
+        accepted = bool(u < accept_prob)
+        if accepted:
             G_t = G_t_plus_1
-        
-        walk.append(G_t)
-    
-    return walk
+
+        if profile.enabled:
+            profile.add_time('acceptance', time.perf_counter() - proposed)
+            profile.step(accepted, len(G_t))
+
+        if t >= burn_in and (t - burn_in) % thinning == 0:
+            yield G_t, accepted
+
+# -------------------------------------------------------------------------
+# Fold the states of a chain into a list of reducers
+# -------------------------------------------------------------------------
+# chain: A generator of pairs (G_t, accepted), as returned by mcmc_chain
+# reducers: A list of reducers (see reducers.py)
+# stopping: A reducer with a done method (such as reducers.AdaptiveStopping)
+#           that ends the chain early, or None to run the whole chain
+# -------------------------------------------------------------------------
+# Returns: The list of reducers, updated with every state of the chain
+# -------------------------------------------------------------------------
+def reduce_chain(chain, reducers, stopping=None):
+    for G_t, accepted in chain:
+        for reducer in reducers:
+            reducer.update(G_t, accepted)
+        if stopping is not None:
+            stopping.update(G_t, accepted)
+            if stopping.done():
+                break
+    return reducers
+
+# -------------------------------------------------------------------------
+# Generating walk of length n_steps from initial_graph
+# -------------------------------------------------------------------------
+# initial_graph: Graph at time 0
+# S: Sampled path from Galsont-Watson process
+# W: Maximum out-degree of G_t
+# L: Number of levels in G_t
+# offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
+# p: Probability of sampling a path from Galsont-Watson process
+# n_steps: Number of steps in the walk
+# burn_in: Number of initial states that are discarded
+# thinning: Keep one state every thinning steps
+# reducers: A list of reducers that summarize the walk. If None, the walk
+#           itself is returned
+# stopping: A stopping rule (such as reducers.AdaptiveStopping) that ends
+#           the walk before n_steps, which is then a cap on its length
+# n_tries: Number of candidates of each step of the multiple-try Metropolis
+#          rule (1 for the plain Metropolis-Hastings rule)
+# model: chain_state.SampleModel of S (built from the arguments if None)
+# -------------------------------------------------------------------------
+# Returns: A walk of length n_steps from initial_graph, or the results of
+#          the reducers if they were given
+# -------------------------------------------------------------------------
+def mcmc_walk(initial_graph, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps,
+              burn_in=0, thinning=1, reducers=None, stopping=None, n_tries=1, model=None):
+    chain = mcmc_chain(initial_graph, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, burn_in, thinning,
+                       n_tries, model)
+
+    if reducers is None:
+        return reduce_chain(chain, [StateCollector()], stopping)[0].result()
+
+    return [reducer.result() for reducer in reduce_chain(chain, reducers, stopping)]
 
 
 # -------------------------------------------------------------------------
@@ -45,13 +138,18 @@ def mcmc_walk(initial_graph, S, n_sampled_nodes, W, L, offspring_distribution, p
 # L: Number of levels in G_t
 # offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
 # -------------------------------------------------------------------------
-# Returns: A proposal graph G_t+1
+# Returns: A proposal graph G_t+1 and the log transition probabilities
+#          from G_t to G_t+1 and from G_t+1 to G_t
 # -------------------------------------------------------------------------
 def proposal_transition(G_t, W, L, offspring_distribution):
+    if not isinstance(G_t, ChainState):
+        G_t = as_compact_tree(G_t)
+
     # Choose an internal node v in G_t
-    v = random.choice([x for x in G_t.nodes() if G_t.out_degree(x) > 0])
-    d = G_t.out_degree()[v]
-    l = nx.shortest_path_length(G_t, 0, v)
+    internal_nodes = G_t.internal_nodes
+    v = int(internal_nodes[random.randrange(len(internal_nodes))])
+    d = int(G_t.out_degree[v])
+    l = int(G_t.depth[v])
 
     # Decide whether to add or remove a tree
     if d == 1:
@@ -68,31 +166,31 @@ def proposal_transition(G_t, W, L, offspring_distribution):
     # Add a tree to G_t
     if action == 'add':
         T_v = galton_watson(offspring_distribution, L - l - 1)
-        G_t_plus_1 = nx.disjoint_union(G_t, T_v)
-        G_t_plus_1.add_edge(list(G_t.nodes()).index(v), len(G_t.nodes()))
+        G_t_plus_1 = G_t.attach(v, T_v)
 
-        trans_prob_from_G_t = 0.5**(d > 1) * galton_watson_probability(T_v, offspring_distribution)
-        trans_prob_from_G_t_plus_1 = (0.5**(d + 1 < W)) * ((d + 1)**-1)
+        log_trans_prob_from_G_t = np.log(0.5**(d > 1)) + log_galton_watson_probability(T_v, offspring_distribution)
+        log_trans_prob_from_G_t_plus_1 = np.log(0.5**(d + 1 < W))
 
     # Remove a tree from G_t  
     elif action == 'remove':
-        v_children = random.choice(list(G_t.successors(v)))
-        G_t_plus_1 = remove_tree(v_children, G_t.copy())
-
-        T_v = nx.DiGraph()
-        T_v.add_edges_from(G_t.edges - G_t_plus_1.edges)
+        v_children = int(random.choice(G_t.successors(v)))
+        G_t_plus_1 = remove_tree(v_children, G_t)
 
-        trans_prob_from_G_t = (0.5**(d < W)) * (d**-1)
-        trans_prob_from_G_t_plus_1 = (0.5**(d-1 > 1)) * galton_watson_probability(T_v, offspring_distribution)
+        # The reverse move has to grow back exactly the removed subtree
+        T_v = G_t.subtree(v_children)
 
-    L_i = len([x for x in G_t.nodes() if G_t.out_degree(x)==0])
-    L_i_plus_1 = len([x for x in G_t_plus_1.nodes() if G_t_plus_1.out_degree(x)==0])
+        log_trans_prob_from_G_t = np.log(0.5**(d < W))
+        log_trans_prob_from_G_t_plus_1 = np.log(0.5**(d-1 > 1)) + log_galton_watson_probability(T_v, offspring_distribution)
 
-    # Calculate the transition probabilities
-    trans_prob_from_G_t = trans_prob_from_G_t/(len(G_t.nodes()) - L_i - 1)
-    trans_prob_from_G_t_plus_1 = trans_prob_from_G_t_plus_1/(len(G_t_plus_1.nodes()) - L_i_plus_1 - 1)
+    # Calculate the transition probabilities. The node v is one of the
+    # n_internal internal nodes. The choice of the removed child needs no
+    # term: the likelihood does not depend on the order of the children, so
+    # growing the subtree as the last child stands for growing it at any of
+    # the d positions, each one reversed by removing that child.
+    log_trans_prob_from_G_t -= np.log(G_t.n_internal)
+    log_trans_prob_from_G_t_plus_1 -= np.log(G_t_plus_1.n_internal)
 
-    return G_t_plus_1, trans_prob_from_G_t, trans_prob_from_G_t_plus_1
+    return G_t_plus_1, log_trans_prob_from_G_t, log_trans_prob_from_G_t_plus_1
 
 
 # -------------------------------------------------------------------------
@@ -102,27 +200,78 @@ def proposal_transition(G_t, W, L, offspring_distribution):
 # G_t_plus_1: Proposal graph at time t+1
 # p: Probability of sampling a node
 # offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
-# trans_prob_from_G_t: Transition probability from G_t to G_t+1
-# trans_prob_from_G_t_plus_1: Transition probability from G_t+1 to G_t
+# log_trans_prob_from_G_t: Log transition probability from G_t to G_t+1
+# log_trans_prob_from_G_t_plus_1: Log transition probability from G_t+1 to G_t
 # -------------------------------------------------------------------------
 # Returns: The probability of accepting the proposal
 # -------------------------------------------------------------------------
 def acceptance_function(sampled_graph, n_sampled_nodes, G_t, G_t_plus_1, p, 
-                        offspring_distribution, trans_prob_from_G_t, trans_prob_from_G_t_plus_1):
+                        offspring_distribution, log_trans_prob_from_G_t, log_trans_prob_from_G_t_plus_1):
+    # The states of the chain already carry their likelihood, only the ratio is left
+    if isinstance(G_t, ChainState) and isinstance(G_t_plus_1, ChainState):
+        log_acceptance = (G_t_plus_1.log_likelihood + log_trans_prob_from_G_t_plus_1
+                          - G_t.log_likelihood - log_trans_prob_from_G_t)
+        return np.exp(min(log_acceptance, 0))
 
-    # Calculate the probability of sampling S from G_t and G_t+1
-    prob_S_from_G_t_plus_1 = sampling_probability(sampled_graph, G_t_plus_1, p, n_sampled_nodes)
-    prob_S_from_G_t = sampling_probability(sampled_graph, G_t, p, n_sampled_nodes)
+    sampled_graph = as_compact_tree(sampled_graph)
+    G_t = as_compact_tree(G_t)
+    G_t_plus_1 = as_compact_tree(G_t_plus_1)
 
-    # Calculate the probability of sampling G_t and G_t+1 from Galton-Watson process with offspring_distribution
-    prob_G_t_plus_1 = galton_watson_probability(G_t_plus_1, offspring_distribution)
-    prob_G_t = galton_watson_probability(G_t, offspring_distribution)
+    # Calculate the log-probability of sampling S from G_t and G_t+1
+    log_prob_S_from_G_t_plus_1 = log_sampling_probability(sampled_graph, G_t_plus_1, p, n_sampled_nodes)
+    log_prob_S_from_G_t = log_sampling_probability(sampled_graph, G_t, p, n_sampled_nodes)
+
+    # Calculate the log-probability of sampling G_t and G_t+1 from Galton-Watson process with offspring_distribution
+    log_prob_G_t_plus_1 = log_galton_watson_probability(G_t_plus_1, offspring_distribution)
+    log_prob_G_t = log_galton_watson_probability(G_t, offspring_distribution)
 
     # Calculate the acceptance function
-    acceptance = (prob_S_from_G_t_plus_1*prob_G_t_plus_1*trans_prob_from_G_t_plus_1)/(prob_S_from_G_t*prob_G_t*trans_prob_from_G_t)
+    log_acceptance = (log_prob_S_from_G_t_plus_1 + log_prob_G_t_plus_1 + log_trans_prob_from_G_t_plus_1
+                      - log_prob_S_from_G_t - log_prob_G_t - log_trans_prob_from_G_t)
     
     # Return the acceptance probability
-    return min(1, acceptance)
+    return np.exp(min(log_acceptance, 0))
+
+
+# -------------------------------------------------------------------------
+# Multiple-try Metropolis transition from G_t
+# -------------------------------------------------------------------------
+# Following Liu, Liang and Wong (2000), n_tries candidates y_j are drawn
+# from G_t with proposal_transition and weighted by
+# w(y_j, G_t) = P(S, y_j) T(y_j -> G_t). One of them, y, is selected with
+# probability proportional to its weight, and n_tries - 1 reference trees
+# x_j are drawn from y, the last reference being G_t itself. The selected
+# candidate is accepted with probability
+# min(1, sum_j w(y_j, G_t) / sum_j w(x_j, y)).
+#
+# Every candidate and every reference is a ChainState of its own, built
+# one after the other by proposal_transition, so a step costs
+# 2 n_tries - 1 proposals. The weights are then compared in log scale.
+# -------------------------------------------------------------------------
+# G_t: ChainState at time t
+# W: Maximum out-degree of G_t
+# L: Number of levels in G_t
+# offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
+# n_tries: Number of candidates
+# -------------------------------------------------------------------------
+# Returns: The selected candidate and its acceptance probability
+# -------------------------------------------------------------------------
+def multiple_try_transition(G_t, W, L, offspring_distribution, n_tries):
+    candidates = [proposal_transition(G_t, W, L, offspring_distribution) for _ in range(n_tries)]
+    log_weights = np.array([y.log_likelihood + log_prob_back for y, _, log_prob_back in candidates])
+    log_total = logsumexp(log_weights)
+    if log_total == -np.inf:
+        return G_t, 0.0
 
+    # Select a candidate with probability proportional to its weight
+    cumulative = np.cumsum(np.exp(log_weights - log_total))
+    j = min(int(np.searchsorted(cumulative, random.random() * cumulative[-1], side='right')), n_tries - 1)
+    y, log_prob_forward, _ = candidates[j]
 
+    # Reference trees drawn from the selected candidate, completed with G_t
+    references = [proposal_transition(y, W, L, offspring_distribution) for _ in range(n_tries - 1)]
+    log_reference_weights = np.array([x.log_likelihood + log_prob_back for x, _, log_prob_back in references]
+                                     + [G_t.log_likelihood + log_prob_forward])
 
+    log_acceptance = log_total - logsumexp(log_reference_weights)
+    return y, np.exp(min(log_acceptance, 0))
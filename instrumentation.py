@@ -0,0 +1,159 @@
+# Description: Opt-in profiling of the stages of an experiment and of the behaviour of the chain
+# Author: agent
+# Date: October 2026
+import json
+import time
+
+# -------------------------------------------------------------------------
+# Profile of a run
+# -------------------------------------------------------------------------
+# The hot paths check the enabled flag before touching the profile, so a
+# disabled profile costs a single attribute lookup per check. When it is
+# enabled, the profile accumulates:
+#   - the time spent and the number of calls of each stage
+#   - counters of the map counting (rows computed, cache hits, permanents)
+#   - the shapes of the matrices whose permanents were computed
+#   - the acceptance rate and the tree size of the chain, averaged over
+#     windows of trace_every steps
+# Every window of the chain and every finished stage of the experiment is
+# also written as a line of JSON to the log file, if one was given.
+# -------------------------------------------------------------------------
+class Profile:
+    def __init__(self):
+        self.enabled = False
+        self.log_file = None
+        self.reset()
+
+    # -------------------------------------------------------------------------
+    # Clear the accumulated measurements
+    # -------------------------------------------------------------------------
+    # trace_every: Number of steps of the chain in each window of the trace
+    # -------------------------------------------------------------------------
+    def reset(self, trace_every=100):
+        self.trace_every = trace_every
+        self.stage_times = {}
+        self.stage_calls = {}
+        self.counters = {}
+        self.matrix_shapes = {}
+        self.trace = []
+        self._window_steps = 0
+        self._window_accepted = 0
+        self._window_size = 0
+        self._step = 0
+
+    # -------------------------------------------------------------------------
+    # Add the duration of one call of a stage
+    # -------------------------------------------------------------------------
+    def add_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+        self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    # -------------------------------------------------------------------------
+    # Increment a counter
+    # -------------------------------------------------------------------------
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # -------------------------------------------------------------------------
+    # Count the permanents computed on matrices of a given shape
+    # -------------------------------------------------------------------------
+    def matrix_shape(self, n_rows, n_columns, n=1):
+        key = f'{n_rows}x{n_columns}'
+        self.matrix_shapes[key] = self.matrix_shapes.get(key, 0) + n
+
+    # -------------------------------------------------------------------------
+    # Record a step of the chain
+    # -------------------------------------------------------------------------
+    # accepted: Whether the proposal was accepted
+    # tree_size: Number of nodes of the state after the step
+    # -------------------------------------------------------------------------
+    def step(self, accepted, tree_size):
+        self._step += 1
+        self._window_steps += 1
+        self._window_accepted += accepted
+        self._window_size += tree_size
+
+        if self._window_steps == self.trace_every:
+            window = {
+                'step': self._step,
+                'acceptance_rate': self._window_accepted/self._window_steps,
+                'mean_tree_size': self._window_size/self._window_steps,
+            }
+            self.trace.append(window)
+            self.log(dict(window, event='chain'))
+            self._window_steps = 0
+            self._window_accepted = 0
+            self._window_size = 0
+
+    # -------------------------------------------------------------------------
+    # Write an event to the log file
+    # -------------------------------------------------------------------------
+    def log(self, event):
+        if self.log_file is not None:
+            self.log_file.write(json.dumps(event) + '\n')
+
+    # -------------------------------------------------------------------------
+    # Summary of the measurements
+    # -------------------------------------------------------------------------
+    # Returns: A dictionary with the stage times and calls, the counters,
+    #          the permanent shapes and the trace of the chain
+    # -------------------------------------------------------------------------
+    def summary(self):
+        return {
+            'stage_times': dict(self.stage_times),
+            'stage_calls': dict(self.stage_calls),
+            'counters': dict(self.counters),
+            'matrix_shapes': dict(self.matrix_shapes),
+            'trace': list(self.trace),
+        }
+
+
+# Profile shared by the modules of the estimator, disabled by default
+profile = Profile()
+
+# -------------------------------------------------------------------------
+# Start profiling
+# -------------------------------------------------------------------------
+# log_path: Path of a JSON-lines file where the events are streamed (None
+#           to keep them in memory only), overwritten if it exists
+# trace_every: Number of steps of the chain in each window of the trace
+# -------------------------------------------------------------------------
+def enable(log_path=None, trace_every=100):
+    profile.reset(trace_every)
+    profile.log_file = open(log_path, 'w') if log_path is not None else None
+    profile.enabled = True
+
+# -------------------------------------------------------------------------
+# Stop profiling
+# -------------------------------------------------------------------------
+# Returns: The summary of the measurements taken since enable was called
+# -------------------------------------------------------------------------
+def disable():
+    profile.enabled = False
+    if profile.log_file is not None:
+        profile.log_file.close()
+        profile.log_file = None
+    return profile.summary()
+
+# -------------------------------------------------------------------------
+# Time a function call as a stage
+# -------------------------------------------------------------------------
+# Meant for the coarse stages of an experiment, the hot paths check the
+# flag themselves.
+# -------------------------------------------------------------------------
+# stage: Name of the stage
+# function: Function to be called
+# args: Arguments of the function
+# -------------------------------------------------------------------------
+# Returns: The value returned by the function
+# -------------------------------------------------------------------------
+def timed(stage, function, *args, **kwargs):
+    if not profile.enabled:
+        return function(*args, **kwargs)
+
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    profile.add_time(stage, seconds)
+    profile.log({'event': 'stage', 'stage': stage, 'seconds': seconds})
+    return value
@@ -0,0 +1,79 @@
+# Description: Monte Carlo EM estimation of the offspring distribution
+# Author: agent
+# Date: October 2026
+import numpy as np
+from graph_mcmc import mcmc_walk
+from optimization import em_update, importance_sample_size
+from reducers import OffspringCounts, LastState, make_stopping
+
+# -------------------------------------------------------------------------
+# Monte Carlo EM
+# -------------------------------------------------------------------------
+# The E-step samples the hidden tree given S with a chain whose offspring
+# distribution is the current estimate, and the M-step maximizes the
+# expected complete-data log-likelihood over the states of the chain (see
+# optimization.em_update). The states are weighted by the ratio between
+# their probabilities under the current and the sampling distribution, so
+# the states of a chain keep being used by the following iterations while
+# their importance weights are balanced enough: a new chain is only run
+# when the effective sample size of the reweighted states falls below
+# min_ess_fraction of the number of states. Each new chain starts from the
+# last state of the previous one, so only the first chain is burned in.
+#
+# The iterations stop once no entry of the estimate moves more than
+# tolerance, or after max_iterations iterations.
+# -------------------------------------------------------------------------
+# initial_graph: Graph from which the first chain starts
+# S: Sampled graph
+# n_sampled_nodes: Number of nodes sampled into S
+# W: Maximum out-degree of the hidden tree
+# L: Number of levels of the hidden tree
+# p: Probability that a node is sampled
+# theta_0: Initial offspring distribution
+# n_steps: Number of steps of each chain (the cap of its length if it
+#          stops adaptively)
+# max_iterations: Maximum number of EM iterations
+# tolerance: Largest change of the estimate for the iterations to stop
+# min_ess_fraction: Fraction of the states under which the effective
+#                   sample size triggers a new chain
+# burn_in: Number of initial states of the first chain that are discarded
+# thinning: Keep one state of each chain every thinning steps
+# target_ess: If given, each chain stops once the offspring frequencies
+#             reach this effective sample size
+# target_se: If given, each chain stops once the standard errors of the
+#            offspring frequencies are below this value
+# -------------------------------------------------------------------------
+# Returns: The estimated distribution and a list with a dictionary per
+#          iteration (estimate, effective sample size, number of states and
+#          whether a new chain was run)
+# -------------------------------------------------------------------------
+def monte_carlo_em(initial_graph, S, n_sampled_nodes, W, L, p, theta_0, n_steps, max_iterations=20,
+                   tolerance=1e-3, min_ess_fraction=0.5, burn_in=0, thinning=1, target_ess=None, target_se=None):
+    theta = np.asarray(theta_0, dtype=np.float64)
+    G_t = initial_graph
+    counts, multiplicity, theta_g = None, None, None
+    history = []
+
+    for iteration in range(max_iterations):
+        # E-step: reuse the states of the last chain while their weights are balanced enough
+        ess = importance_sample_size(counts, multiplicity, theta, theta_g) if counts is not None else 0.0
+        new_chain = counts is None or ess < min_ess_fraction * multiplicity.sum()
+        if new_chain:
+            stopping = make_stopping(target_ess, target_se)
+            (counts, multiplicity), G_t = mcmc_walk(G_t, S, n_sampled_nodes, W, L, theta, p, n_steps,
+                                                    burn_in if iteration == 0 else 0, thinning,
+                                                    reducers=[OffspringCounts(), LastState()], stopping=stopping)
+            theta_g = theta
+            ess = float(multiplicity.sum())
+
+        # M-step
+        new_theta = em_update(counts, multiplicity, theta, theta_g)
+        change = np.abs(new_theta - theta).max()
+        theta = new_theta
+
+        history.append({'theta': theta, 'ess': ess, 'n_states': int(multiplicity.sum()),
+                        'new_chain': new_chain, 'change': change})
+        if change < tolerance:
+            break
+
+    return theta, history
@@ -0,0 +1,123 @@
+# Description: Independent MCMC chains run in parallel, with convergence diagnostics
+# Author: agent
+# Date: October 2026
+import random
+from multiprocessing import Pool
+import numpy as np
+from compact_tree import CompactTree, as_compact_tree
+from diagnostics import gelman_rubin, effective_sample_size
+from graph_mcmc import mcmc_walk
+from reducers import OffspringCounts, OffspringTrace, AcceptanceRate, merge_offspring_counts
+from sampling_model import galton_watson_forest
+from seeding import seed_process, spawn_seeds
+
+# -------------------------------------------------------------------------
+# Initial tree of a chain built around the sampled graph
+# -------------------------------------------------------------------------
+# Every leaf of S above the last level receives a Galton-Watson subtree, so
+# that the tree has all of its leaves at level L and contains S. When
+# dispersed, every node of S also receives a random number of extra
+# subtrees, which spreads the initial trees of different chains.
+# -------------------------------------------------------------------------
+# S: Sampled graph
+# W: Maximum out-degree of the tree
+# L: Number of levels of the tree
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children
+# dispersed: Whether to add random extra subtrees to the nodes of S
+# -------------------------------------------------------------------------
+# Returns: A tree containing S
+# -------------------------------------------------------------------------
+def initial_tree(S, W, L, offspring_distribution, dispersed=False):
+    S = as_compact_tree(S)
+
+    # Number of subtrees grown under every node of S above the last level
+    n_new_children = np.zeros(len(S), dtype=np.int64)
+    for v in np.flatnonzero(S.depth < L - 1).tolist():
+        d = int(S.out_degree[v])
+        n_new_children[v] = random.randint(int(d == 0), W - d) if dispersed else int(d == 0)
+
+    # The subtrees of the nodes at each depth are grown together, and their nodes are
+    # appended after the nodes of S, which keeps the labels of S
+    parent = [S.parent]
+    n_nodes = len(S)
+    for l in np.unique(S.depth[n_new_children > 0]).tolist():
+        at_depth = np.flatnonzero(S.depth == l)
+        roots = np.repeat(at_depth, n_new_children[at_depth])
+        for v, T in zip(roots.tolist(), galton_watson_forest(offspring_distribution, L - l - 1, len(roots))):
+            T_parent = T.parent + n_nodes
+            T_parent[0] = v
+            parent.append(T_parent)
+            n_nodes += len(T)
+
+    return CompactTree(np.concatenate(parent))
+
+# -------------------------------------------------------------------------
+# Run a single chain of the pool
+# -------------------------------------------------------------------------
+# task: Tuple with the seed of the chain, its initial graph (or 'sample' /
+#       'dispersed' to build it from S) and the arguments of mcmc_walk
+# -------------------------------------------------------------------------
+# Returns: The offspring counts, the offspring trace and the acceptance rate of the chain
+# -------------------------------------------------------------------------
+def _run_chain(task):
+    seed, initial, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, burn_in, thinning = task
+
+    # Every chain has its own random stream
+    seed_process(seed)
+
+    if isinstance(initial, str):
+        initial = initial_tree(S, W, L, offspring_distribution, dispersed=initial == 'dispersed')
+
+    return mcmc_walk(initial, S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, burn_in, thinning,
+                     reducers=[OffspringCounts(), OffspringTrace(), AcceptanceRate()])
+
+# -------------------------------------------------------------------------
+# Run independent chains in a process pool
+# -------------------------------------------------------------------------
+# S: Sampled path from Galsont-Watson process
+# n_sampled_nodes: Number of nodes sampled into S
+# W: Maximum out-degree of G_t
+# L: Number of levels in G_t
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+# p: Probability of sampling a path from Galsont-Watson process
+# n_steps: Number of steps in each walk
+# n_chains: Number of chains
+# initial: 'sample' to start every chain from S completed to L levels,
+#          'dispersed' to also add random subtrees to S, or a list with the
+#          initial graph of each chain
+# burn_in: Number of initial states of each walk that are discarded
+# thinning: Keep one state of each walk every thinning steps
+# seed: Seed from which the seeds of the chains are derived
+# n_processes: Number of processes of the pool (one per core if None)
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the merged offspring counts and multiplicities,
+#          and the R-hat and effective sample size of each offspring count
+# -------------------------------------------------------------------------
+def run_chains(S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, n_chains,
+               initial='dispersed', burn_in=0, thinning=1, seed=None, n_processes=None):
+    S = as_compact_tree(S)
+    seeds = spawn_seeds(seed, n_chains)
+    initials = [initial]*n_chains if isinstance(initial, str) else list(initial)
+
+    tasks = [(seeds[k], initials[k], S, n_sampled_nodes, W, L, offspring_distribution, p, n_steps, burn_in, thinning)
+             for k in range(n_chains)]
+
+    if n_processes == 1:
+        chains = [_run_chain(task) for task in tasks]
+    else:
+        with Pool(n_processes) as pool:
+            chains = pool.map(_run_chain, tasks)
+
+    # Merge the sufficient statistics of the chains
+    counts, multiplicity = merge_offspring_counts(statistics for statistics, _, _ in chains)
+
+    traces = np.stack([trace for _, trace, _ in chains])
+
+    return {
+        'counts': counts,
+        'multiplicity': multiplicity,
+        'r_hat': gelman_rubin(traces),
+        'ess': effective_sample_size(traces),
+        'acceptance_rate': np.array([rate for _, _, rate in chains]),
+    }
@@ -1,71 +1,285 @@
 # Description: This file contains the implementation of the expectation maximization algorithm
 # Author: Ronald Albert
 # Date: June 2023
-from sampling_model import galton_watson_probability
-import networkx as nx
+from chain_store import stored_offspring_counts
+from sampling_model import offspring_count, log_distribution
 from scipy.optimize import minimize
+from scipy.special import logsumexp
 import numpy as np
 
+# Smallest probability of an entry of the EM estimates
+_EM_FLOOR = 1e-6
+
 # -------------------------------------------------------------------------
-# Calculate the expectation of the log-likelihood function
+# Stack the sufficient statistics of a list of graphs
 # -------------------------------------------------------------------------
 # graph_list: A list of graphs
+# W: Maximum out-degree of the graphs
+# -------------------------------------------------------------------------
+# Returns: An (n_graphs x W) matrix with the offspring counts of each graph
+# -------------------------------------------------------------------------
+def offspring_count_matrix(graph_list, W):
+    return np.array([offspring_count(graph, W) for graph in graph_list]).reshape(-1, W)
+
+# -------------------------------------------------------------------------
+# Collapse repeated rows of an offspring count matrix
+# -------------------------------------------------------------------------
+# The walk repeats a state every time a proposal is rejected, and the
+# objective only depends on the offspring counts, so every distinct row
+# is evaluated once and weighted by its number of occurrences.
+# -------------------------------------------------------------------------
+# counts: An (n_graphs x W) matrix of offspring counts
+# -------------------------------------------------------------------------
+# Returns: The distinct rows and the number of times each of them occurs
+# -------------------------------------------------------------------------
+def unique_offspring_counts(counts):
+    return np.unique(counts, axis=0, return_counts=True)
+
+# -------------------------------------------------------------------------
+# Offspring distribution from the unconstrained parameters
+# -------------------------------------------------------------------------
+# The last parameter is fixed to 1. This is done because there is a
+# restriction on theta to belong to the interval [0, 1], since it's a
+# distribution. So we assume alphas parameters to belong to the real space
+# and fit then into the [0, 1] interval with a softmax function.
+# -------------------------------------------------------------------------
+# alphas: An array of parameters, with an optional leading batch axis
+# -------------------------------------------------------------------------
+# Returns: The logarithm of the distribution theta
+# -------------------------------------------------------------------------
+def _log_theta(alphas):
+    alphas = np.asarray(alphas, dtype=np.float64)
+    alphas = np.concatenate([alphas, np.ones(alphas.shape[:-1] + (1,))], axis=-1)
+    return alphas - logsumexp(alphas, axis=-1, keepdims=True)
+
+# -------------------------------------------------------------------------
+# Calculate the logarithm of the expectation of the log-likelihood function
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs
+# multiplicity: Number of graphs with each row of offspring counts
+# alphas: A list of parameters, or a matrix with one list of parameters per row
+# theta_g: A list of parameters
+# -------------------------------------------------------------------------
+# Returns: The logarithm of the expectation, for each list of parameters
+# -------------------------------------------------------------------------
+def log_unormalized_expectation(counts, multiplicity, alphas, theta_g):
+    # Log importance weights of the graphs, which were generated under theta_g
+    log_weights = np.log(multiplicity) - counts @ log_distribution(theta_g)
+
+    log_expectation = logsumexp(log_weights[:, np.newaxis] + counts @ _log_theta(np.atleast_2d(alphas)).T, axis=0)
+    return log_expectation if np.ndim(alphas) > 1 else log_expectation[0]
+
+# -------------------------------------------------------------------------
+# Gradient of the logarithm of the expectation with respect to alphas
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs
+# multiplicity: Number of graphs with each row of offspring counts
 # alphas: A list of parameters
 # theta_g: A list of parameters
 # -------------------------------------------------------------------------
-# Returns: The expectation of the log-likelihood function
+# Returns: The gradient with respect to the free parameters
 # -------------------------------------------------------------------------
-def unormalized_expectation(graph_list, alphas, theta_g):
-    expected_value = 0
+def log_unormalized_expectation_gradient(counts, multiplicity, alphas, theta_g):
+    log_theta = _log_theta(alphas)
+    log_terms = np.log(multiplicity) - counts @ log_distribution(theta_g) + counts @ log_theta
 
-    # Add the last parameter to the list of parameters
-    # This is done because there is a restriction on theta
-    # to belong to the interval [0, 1], since it's a distribution.
-    # So we assume alphas parameters to belong to the real space
-    # and fit then into the [0, 1] interval with a softmax function
-    alphas = np.append(alphas,1)
+    # Share of each graph in the expectation
+    share = np.exp(log_terms - logsumexp(log_terms))
 
-    # Calculate the normalization constant
-    normalization_constant = np.sum(np.e**alphas)
+    # d/d alpha_j of counts @ log(theta) is counts_j - theta_j * sum(counts)
+    expected_counts = share @ counts
+    gradient = expected_counts - np.exp(log_theta) * expected_counts.sum()
 
-    # Calculate the distribution theta from the parameters
-    theta = (np.e**alphas)/normalization_constant 
+    return gradient[:-1]
 
-    # Calculate the expectation 
-    for graph in graph_list:
-        expected_value += galton_watson_probability(graph,theta)/galton_watson_probability(graph, theta_g)
+# -------------------------------------------------------------------------
+# Effective sample size of the graphs reweighted to another distribution
+# -------------------------------------------------------------------------
+# The graphs were generated under theta_g, and their importance weights
+# under theta are the ratios between their Galton-Watson probabilities,
+# since the probability of the sample given a graph does not depend on
+# the offspring distribution.
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs
+# multiplicity: Number of graphs with each row of offspring counts
+# theta: Distribution to which the graphs are reweighted
+# theta_g: Distribution under which the graphs were generated
+# -------------------------------------------------------------------------
+# Returns: The Kish effective sample size of the importance weights
+# -------------------------------------------------------------------------
+def importance_sample_size(counts, multiplicity, theta, theta_g):
+    log_ratio = counts @ (log_distribution(theta) - log_distribution(theta_g))
+    log_multiplicity = np.log(multiplicity)
+    return np.exp(2*logsumexp(log_multiplicity + log_ratio) - logsumexp(log_multiplicity + 2*log_ratio))
 
-    return expected_value
+# -------------------------------------------------------------------------
+# Keep every entry of an EM estimate away from zero
+# -------------------------------------------------------------------------
+# An estimate is the offspring distribution of the next walk and the
+# target of the importance weights, where log_distribution ignores the
+# entries with probability 0. A zero would then favour the out-degree it
+# rules out, and no walk could generate it again to correct the estimate.
+# -------------------------------------------------------------------------
+# theta: An estimate of the distribution
+# -------------------------------------------------------------------------
+# Returns: The estimate with every entry at least _EM_FLOOR, normalized
+# -------------------------------------------------------------------------
+def _floor_distribution(theta):
+    theta = np.maximum(theta, _EM_FLOOR)
+    return theta/theta.sum()
 
 # -------------------------------------------------------------------------
-# Calculate the distribution that maximizes the expectation of the log-likelihood function
+# EM update of the offspring distribution
+# -------------------------------------------------------------------------
+# The expected complete-data log-likelihood, E[counts] @ log(theta) under
+# the posterior of the graphs given theta, is maximized by the expected
+# offspring counts of the internal nodes (see sampling_model.offspring_count)
+# normalized to sum 1. The expectation is estimated with
+# the graphs generated under theta_g, weighted by their importance
+# weights under theta. Entries are floored at _EM_FLOOR (see
+# _floor_distribution).
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs
+# multiplicity: Number of graphs with each row of offspring counts
+# theta: Current estimate of the distribution
+# theta_g: Distribution under which the graphs were generated
+# -------------------------------------------------------------------------
+# Returns: The updated estimate of the distribution
+# -------------------------------------------------------------------------
+def em_update(counts, multiplicity, theta, theta_g):
+    log_weights = np.log(multiplicity) + counts @ (log_distribution(theta) - log_distribution(theta_g))
+    expected_counts = np.exp(log_weights - logsumexp(log_weights)) @ counts
+    return _floor_distribution(expected_counts/expected_counts.sum())
+
+# -------------------------------------------------------------------------
+# Importance weights of the graphs of a batch of chains
+# -------------------------------------------------------------------------
+# The chain of each observation has its own sampling distribution, and the
+# weights are normalized over the graphs of each chain, after subtracting
+# the largest log-weight of the chain so that they do not underflow.
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs of every chain
+# multiplicity: Number of graphs of its chain with each row of offspring counts
+# observation: Index of the chain of each row
+# theta: Distribution to which the graphs are reweighted
+# theta_g: Matrix with the distribution under which each chain was generated
+# -------------------------------------------------------------------------
+# Returns: The weight of each row, relative to the largest of its chain,
+#          and the sum of the weights of each chain
+# -------------------------------------------------------------------------
+def _pooled_weights(counts, multiplicity, observation, theta, theta_g):
+    log_ratio = log_distribution(theta) - log_distribution(theta_g)
+    log_weights = np.log(multiplicity) + (counts * log_ratio[observation]).sum(axis=1)
+
+    log_max = np.full(len(theta_g), -np.inf)
+    np.maximum.at(log_max, observation, log_weights)
+    weights = np.exp(log_weights - log_max[observation])
+
+    return weights, np.bincount(observation, weights, len(theta_g))
+
+# -------------------------------------------------------------------------
+# Effective sample sizes of the graphs of a batch of chains
+# -------------------------------------------------------------------------
+# The batch counterpart of importance_sample_size, with one value per chain.
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs of every chain
+# multiplicity: Number of graphs of its chain with each row of offspring counts
+# observation: Index of the chain of each row
+# theta: Distribution to which the graphs are reweighted
+# theta_g: Matrix with the distribution under which each chain was generated
+# -------------------------------------------------------------------------
+# Returns: The Kish effective sample size of the importance weights of each chain
+# -------------------------------------------------------------------------
+def pooled_importance_sample_size(counts, multiplicity, observation, theta, theta_g):
+    weights, totals = _pooled_weights(counts, multiplicity, observation, theta, theta_g)
+
+    # Each row stands for multiplicity graphs sharing its weight
+    squares = np.bincount(observation, weights**2/multiplicity, len(theta_g))
+    return totals**2/squares
+
+# -------------------------------------------------------------------------
+# EM update of the offspring distribution from a batch of observations
+# -------------------------------------------------------------------------
+# The hidden trees of independent observations are independent given the
+# offspring distribution, so the expected complete-data log-likelihood is
+# the sum over the observations of their expected offspring counts, each
+# estimated by the chain of its observation as in em_update. A chain may
+# stand for several observations with the same sample, which share its
+# expected counts. Entries are floored as in em_update.
+# -------------------------------------------------------------------------
+# counts: A matrix with the distinct offspring counts of the graphs of every chain
+# multiplicity: Number of graphs of its chain with each row of offspring counts
+# observation: Index of the chain of each row
+# theta: Current estimate of the distribution
+# theta_g: Matrix with the distribution under which each chain was generated
+# n_observations: Number of observations represented by each chain (one
+#                 each if None)
+# -------------------------------------------------------------------------
+# Returns: The updated estimate of the distribution
+# -------------------------------------------------------------------------
+def pooled_em_update(counts, multiplicity, observation, theta, theta_g, n_observations=None):
+    weights, totals = _pooled_weights(counts, multiplicity, observation, theta, theta_g)
+
+    share = weights/totals[observation]
+    if n_observations is not None:
+        share = share*np.asarray(n_observations)[observation]
+
+    expected_counts = share @ counts
+    return _floor_distribution(expected_counts/expected_counts.sum())
+
+# -------------------------------------------------------------------------
+# Calculate the expectation of the log-likelihood function
 # -------------------------------------------------------------------------
 # graph_list: A list of graphs
+# alphas: A list of parameters
 # theta_g: A list of parameters
 # -------------------------------------------------------------------------
+# Returns: The expectation of the log-likelihood function
+# -------------------------------------------------------------------------
+def unormalized_expectation(graph_list, alphas, theta_g):
+    counts, multiplicity = unique_offspring_counts(offspring_count_matrix(graph_list, len(theta_g)))
+    return np.exp(log_unormalized_expectation(counts, multiplicity, alphas, theta_g))
+
+# -------------------------------------------------------------------------
+# Calculate the distribution that maximizes the expectation of the log-likelihood function
+# -------------------------------------------------------------------------
+# The expectation is maximized through its logarithm, which has the same
+# maximizer and does not overflow for large graphs.
+# -------------------------------------------------------------------------
+# graph_list: A list of graphs, the (n_graphs x W) matrix of their offspring
+#             counts, or the path of a chain stored by chain_store.ChainStore
+# theta_g: A list of parameters
+# multiplicity: Number of graphs with each row of offspring counts, if graph_list
+#               holds distinct rows (as returned by reducers.OffspringCounts)
+# -------------------------------------------------------------------------
 # Returns: The distribution that maximizes the expectation of the log-likelihood function
 # -------------------------------------------------------------------------
-def optimized_distribution(graph_list, theta_g):
+def optimized_distribution(graph_list, theta_g, multiplicity=None):
     initial_alpha = theta_g[:-1]
 
-    # Define the objective function
-    obj_function = lambda alpha: -unormalized_expectation(graph_list, alpha, theta_g)
+    # Reduce every graph to its offspring counts once
+    if isinstance(graph_list, str):
+        counts, multiplicity = stored_offspring_counts(graph_list)
+    elif isinstance(graph_list, np.ndarray) and graph_list.ndim == 2:
+        counts = graph_list
+    else:
+        counts = offspring_count_matrix(graph_list, len(theta_g))
+    if multiplicity is None:
+        counts, multiplicity = unique_offspring_counts(counts)
+
+    # Define the objective function and its gradient
+    obj_function = lambda alpha: -log_unormalized_expectation(counts, multiplicity, alpha, theta_g)
+    obj_gradient = lambda alpha: -log_unormalized_expectation_gradient(counts, multiplicity, alpha, theta_g)
 
     # Generate a list of initial parameters
     proposed_initial_alpha = np.random.uniform(0, 1, (1000, len(initial_alpha)))
 
     # Find the best initial parameter for the optimization
-    best_alpha = proposed_initial_alpha[np.argmin(np.apply_along_axis(obj_function, 1, proposed_initial_alpha))]
+    best_alpha = proposed_initial_alpha[np.argmin(obj_function(proposed_initial_alpha))]
 
     # Minimize the objective function, starting from the best initial parameter
     # using the BFGS method for optimization
-    minimization_results = minimize(obj_function, best_alpha, method='BFGS')
-
-    # Add the last parameter to the list of parameters
-    alphas = np.append(minimization_results.x, 1) 
-
-    # Calculate the normalization constant
-    normalization_constant = sum(np.e**alphas)
+    minimization_results = minimize(obj_function, best_alpha, jac=obj_gradient, method='BFGS')
 
     # Calculate the distribution theta from the parameters
-    return np.e**alphas/normalization_constant
\ No newline at end of file
+    return np.exp(_log_theta(minimization_results.x))
@@ -0,0 +1,60 @@
+# Description: Permanent of rectangular matrices, used to count the maps between trees
+# Author: agent
+# Date: October 2026
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Logarithm of the permanents of a batch of matrices of the same shape
+# -------------------------------------------------------------------------
+# For an m x n matrix with m <= n the permanent is the sum, over every
+# injective map f from the rows into the columns, of the products
+# A[i, f(i)]. If the entries are the numbers of maps between subtrees, it
+# is the number of ways of mapping the children of one node into the
+# children of another.
+#
+# The columns are processed one at a time by a dynamic programming over
+# the subsets of rows: after processing a column, dp[mask] holds the
+# weighted number of ways of assigning the rows in mask to distinct
+# columns already processed. The subsets are laid out so that, for row i,
+# the masks with and without bit i are the two halves of a (-1, 2, 2**i)
+# view of dp, which lets every update run as a single array operation over
+# the whole batch. This takes O(n * m * 2**m) operations per matrix.
+#
+# Every row is scaled by its largest entry before leaving the log domain,
+# since perm(diag(r) A) = prod(r) perm(A). The scaled entries lie in
+# [0, 1], so the permanent can neither overflow nor lose the small terms.
+# -------------------------------------------------------------------------
+# log_matrices: A (batch x m x n) array with the logarithm of the entries
+# -------------------------------------------------------------------------
+# Returns: An array with the logarithm of the permanent of each matrix
+# -------------------------------------------------------------------------
+def batch_log_permanent(log_matrices):
+    log_matrices = np.asarray(log_matrices, dtype=np.float64)
+    batch, m, n = log_matrices.shape
+
+    if m == 0:
+        return np.zeros(batch)
+    if m > n or batch == 0:
+        return np.full(batch, -np.inf)
+
+    # Matrices with an empty row have a null permanent, the empty rows are left unscaled
+    row_max = log_matrices.max(axis=2)
+    finite = np.isfinite(row_max)
+    row_max[~finite] = 0.0
+    finite = finite.all(axis=1)
+    scaled = np.exp(log_matrices - row_max[:, :, np.newaxis])
+
+    dp = np.zeros((batch, 1 << m))
+    dp[:, 0] = 1
+    for j in range(n):
+        previous = dp.copy()
+        for i in range(m):
+            without_i = previous.reshape(batch, -1, 2, 1 << i)[:, :, 0, :]
+            with_i = dp.reshape(batch, -1, 2, 1 << i)[:, :, 1, :]
+            with_i += without_i * scaled[:, i, j, np.newaxis, np.newaxis]
+
+    value = dp[:, -1]
+    result = np.full(batch, -np.inf)
+    nonzero = finite & (value > 0)
+    result[nonzero] = np.log(value[nonzero]) + row_max[nonzero].sum(axis=1)
+    return result
@@ -0,0 +1,326 @@
+# Description: Reducers that fold the states of the MCMC chain into running statistics
+# Author: agent
+# Date: October 2026
+from abc import ABC, abstractmethod
+import numpy as np
+from sampling_model import degree_count_to_offspring_count
+
+# -------------------------------------------------------------------------
+# Base class of the reducers
+# -------------------------------------------------------------------------
+# A reducer receives every state kept by the chain through update and
+# summarizes them in result. The state is a ChainState and accepted tells
+# whether the proposal that led to it was accepted (None for the initial
+# state of the chain). A reducer missing either method can not be built.
+# -------------------------------------------------------------------------
+class Reducer(ABC):
+    @abstractmethod
+    def update(self, state, accepted):
+        pass
+
+    @abstractmethod
+    def result(self):
+        pass
+
+
+# -------------------------------------------------------------------------
+# Keep the trees of the chain
+# -------------------------------------------------------------------------
+# Returns: The list of trees, as mcmc_walk used to return
+# -------------------------------------------------------------------------
+class StateCollector(Reducer):
+    def __init__(self):
+        self.trees = []
+
+    def update(self, state, accepted):
+        self.trees.append(state.tree)
+
+    def result(self):
+        return self.trees
+
+
+# -------------------------------------------------------------------------
+# Keep the tree of the last state
+# -------------------------------------------------------------------------
+# Returns: The last tree of the chain, from which another chain can be
+#          warm-started
+# -------------------------------------------------------------------------
+class LastState(Reducer):
+    def __init__(self):
+        self.tree = None
+
+    def update(self, state, accepted):
+        self.tree = state.tree
+
+    def result(self):
+        return self.tree
+
+
+# -------------------------------------------------------------------------
+# Sufficient statistics of the EM algorithm
+# -------------------------------------------------------------------------
+# The objective of optimization.optimized_distribution only depends on
+# the offspring counts of the states, so the distinct rows and their
+# multiplicities are kept instead of the trees.
+# -------------------------------------------------------------------------
+# Returns: The (n_distinct x W) matrix of offspring counts and the number
+#          of states with each row
+# -------------------------------------------------------------------------
+class OffspringCounts(Reducer):
+    def __init__(self):
+        self.multiplicity = {}
+
+    def update(self, state, accepted):
+        row = tuple(degree_count_to_offspring_count(state.degree_count).tolist())
+        self.multiplicity[row] = self.multiplicity.get(row, 0) + 1
+
+    # -------------------------------------------------------------------------
+    # Add a block of distinct offspring counts with their multiplicities
+    # -------------------------------------------------------------------------
+    def merge(self, counts, multiplicity):
+        for row, m in zip(map(tuple, np.asarray(counts).tolist()), np.asarray(multiplicity).tolist()):
+            self.multiplicity[row] = self.multiplicity.get(row, 0) + m
+
+    def result(self):
+        counts = np.array(list(self.multiplicity.keys()), dtype=np.int64)
+        multiplicity = np.array(list(self.multiplicity.values()), dtype=np.int64)
+        return counts, multiplicity
+
+
+# -------------------------------------------------------------------------
+# Merge blocks of offspring counts
+# -------------------------------------------------------------------------
+# blocks: An iterable of pairs (counts, multiplicity), as returned by
+#         OffspringCounts
+# -------------------------------------------------------------------------
+# Returns: The distinct offspring counts of all the blocks and their total
+#          multiplicities
+# -------------------------------------------------------------------------
+def merge_offspring_counts(blocks):
+    merged = OffspringCounts()
+    for counts, multiplicity in blocks:
+        merged.merge(counts, multiplicity)
+    return merged.result()
+
+
+# -------------------------------------------------------------------------
+# Mean out-degree histogram of the states
+# -------------------------------------------------------------------------
+# Returns: The average number of nodes with 0, 1, ..., W children
+# -------------------------------------------------------------------------
+class DegreeHistogram(Reducer):
+    def __init__(self):
+        self.total = 0
+        self.n_states = 0
+
+    def update(self, state, accepted):
+        self.total = self.total + state.degree_count
+        self.n_states += 1
+
+    def result(self):
+        return self.total/self.n_states
+
+
+# -------------------------------------------------------------------------
+# Fraction of accepted proposals
+# -------------------------------------------------------------------------
+# Returns: The acceptance rate of the chain
+# -------------------------------------------------------------------------
+class AcceptanceRate(Reducer):
+    def __init__(self):
+        self.n_accepted = 0
+        self.n_proposals = 0
+
+    def update(self, state, accepted):
+        if accepted is not None:
+            self.n_accepted += accepted
+            self.n_proposals += 1
+
+    def result(self):
+        return self.n_accepted/self.n_proposals if self.n_proposals > 0 else np.nan
+
+
+# -------------------------------------------------------------------------
+# Running summary of the number of nodes of the states
+# -------------------------------------------------------------------------
+# The variance is updated with Welford's algorithm.
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the mean, variance, minimum and maximum sizes
+# -------------------------------------------------------------------------
+class TreeSize(Reducer):
+    def __init__(self):
+        self.n_states = 0
+        self.mean = 0.0
+        self.sum_squares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, state, accepted):
+        size = len(state)
+        self.n_states += 1
+        delta = size - self.mean
+        self.mean += delta/self.n_states
+        self.sum_squares += delta*(size - self.mean)
+        self.min = min(self.min, size)
+        self.max = max(self.max, size)
+
+    def result(self):
+        variance = self.sum_squares/(self.n_states - 1) if self.n_states > 1 else 0.0
+        return {'mean': self.mean, 'variance': variance, 'min': self.min, 'max': self.max}
+
+
+# -------------------------------------------------------------------------
+# Offspring counts of every state, in the order of the chain
+# -------------------------------------------------------------------------
+# Used by the convergence diagnostics, which need the whole trace.
+# -------------------------------------------------------------------------
+# Returns: An (n_states x W) matrix of offspring counts
+# -------------------------------------------------------------------------
+class OffspringTrace(Reducer):
+    def __init__(self):
+        self.rows = []
+
+    def update(self, state, accepted):
+        self.rows.append(degree_count_to_offspring_count(state.degree_count))
+
+    def result(self):
+        return np.array(self.rows)
+
+
+# -------------------------------------------------------------------------
+# Online batch means of a statistic of the states
+# -------------------------------------------------------------------------
+# The states are split into consecutive batches whose sums are kept. When
+# there are 2*n_batches batches, consecutive pairs are merged and the batch
+# size doubles, so the memory stays bounded and the batches grow with the
+# chain, as the batch means estimator needs. The variance of the batch
+# means estimates the asymptotic variance of the mean of the statistic.
+# -------------------------------------------------------------------------
+# statistic: Function from a ChainState to an array of statistics
+# n_batches: Minimum number of complete batches kept once the chain is long enough
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the mean, the standard error of the mean and
+#          the effective sample size of each statistic (nan for the
+#          statistics that never vary)
+# -------------------------------------------------------------------------
+class BatchMeans(Reducer):
+    def __init__(self, statistic, n_batches=32):
+        self.statistic = statistic
+        self.n_batches = n_batches
+        self.batch_size = 1
+        self.batch_sums = []
+        self.current = 0.0
+        self.n_current = 0
+
+        # Running mean and sum of squares of the statistics, as in TreeSize
+        self.n_states = 0
+        self.mean = 0.0
+        self.sum_squares = 0.0
+
+    def update(self, state, accepted):
+        x = np.asarray(self.statistic(state), dtype=np.float64)
+
+        self.n_states += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta/self.n_states
+        self.sum_squares = self.sum_squares + delta*(x - self.mean)
+
+        self.current = self.current + x
+        self.n_current += 1
+        if self.n_current == self.batch_size:
+            self.batch_sums.append(self.current)
+            self.current = 0.0
+            self.n_current = 0
+            if len(self.batch_sums) == 2*self.n_batches:
+                self.batch_sums = [self.batch_sums[i] + self.batch_sums[i + 1]
+                                   for i in range(0, len(self.batch_sums), 2)]
+                self.batch_size *= 2
+
+    def result(self):
+        nan = np.full(np.shape(self.mean), np.nan)
+        if len(self.batch_sums) < 2:
+            return {'mean': self.mean, 'standard_error': nan, 'ess': nan}
+
+        # Only the states in complete batches enter the batch means
+        n_used = len(self.batch_sums)*self.batch_size
+        batch_means = np.array(self.batch_sums)/self.batch_size
+        asymptotic_variance = self.batch_size*batch_means.var(axis=0, ddof=1)
+        variance = self.sum_squares/(self.n_states - 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ess = np.where(asymptotic_variance > 0, n_used*variance/asymptotic_variance, np.nan)
+        standard_error = np.sqrt(asymptotic_variance/n_used)
+
+        return {'mean': self.mean, 'standard_error': standard_error, 'ess': ess}
+
+
+# -------------------------------------------------------------------------
+# Offspring frequencies of a state
+# -------------------------------------------------------------------------
+# The fraction of the nodes with each number of children, which is the
+# estimate of theta given by a single state and the statistic tracked by
+# the adaptive stopping rule.
+# -------------------------------------------------------------------------
+def offspring_frequencies(state):
+    counts = degree_count_to_offspring_count(state.degree_count)
+    return counts/counts.sum()
+
+
+# -------------------------------------------------------------------------
+# Stopping rule on the effective sample size of the offspring frequencies
+# -------------------------------------------------------------------------
+# The walk is stopped once every offspring frequency has reached the
+# target effective sample size, or once their standard errors are all
+# below the target standard error. Frequencies that never vary are
+# considered exact. The rule is checked every check_every states, and
+# never before min_states states.
+# -------------------------------------------------------------------------
+# target_ess: Effective sample size to be reached (None to ignore it)
+# target_se: Standard error to be reached (None to ignore it)
+# min_states: Minimum number of states before stopping
+# check_every: Number of states between two checks of the rule
+# -------------------------------------------------------------------------
+# Returns: The batch means summary of the offspring frequencies and the
+#          number of states seen
+# -------------------------------------------------------------------------
+class AdaptiveStopping(Reducer):
+    def __init__(self, target_ess=None, target_se=None, min_states=1000, check_every=100):
+        self.target_ess = target_ess
+        self.target_se = target_se
+        self.min_states = min_states
+        self.check_every = check_every
+        self.batch_means = BatchMeans(offspring_frequencies)
+        self.stopped = False
+
+    def update(self, state, accepted):
+        self.batch_means.update(state, accepted)
+
+        n_states = self.batch_means.n_states
+        if n_states < self.min_states or n_states % self.check_every != 0:
+            return
+
+        summary = self.batch_means.result()
+        varying = ~np.isnan(summary['ess'])
+        if self.target_ess is not None and np.all(summary['ess'][varying] >= self.target_ess):
+            self.stopped = True
+        if self.target_se is not None and np.all(summary['standard_error'][varying] <= self.target_se):
+            self.stopped = True
+
+    def done(self):
+        return self.stopped
+
+    def result(self):
+        return dict(self.batch_means.result(), n_states=self.batch_means.n_states)
+
+# -------------------------------------------------------------------------
+# Stopping rule of a walk from its targets
+# -------------------------------------------------------------------------
+# target_ess: Effective sample size to be reached (None to ignore it)
+# target_se: Standard error to be reached (None to ignore it)
+# -------------------------------------------------------------------------
+# Returns: An AdaptiveStopping, or None if there is no target
+# -------------------------------------------------------------------------
+def make_stopping(target_ess=None, target_se=None):
+    if target_ess is None and target_se is None:
+        return None
+    return AdaptiveStopping(target_ess, target_se)
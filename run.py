@@ -1,9 +1,6 @@
-import networkx as nx
 from scipy.stats import zipfian, poisson, randint, binom
 import numpy as np
-from sampling_model import sample
-from experiment import experiment
-import pickle
+from runner import run_experiments
 
 # Path to the results directory
 results_dir = 'results/'
@@ -20,35 +17,43 @@ def truncated_poisson_pmf(min_value, max_value, mu, k):
     max_value_poisson = poisson.cdf(max_value, mu)
     return ((mu**k)*(np.e**(-mu)))/(np.math.factorial(k)*(max_value_poisson - min_value_poisson))
 
+# Maximum number of steps of each walk, which stops earlier once the
+# offspring frequencies reach the target effective sample size
+max_steps = 100000
+target_ess = 1000
+
 # Definition of the experiment.
 experiment_sets =[
-    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.2, 20000),
-    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.5, 20000),
-    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.8, 20000),
-    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.2, 20000),
-    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.5, 20000),
-    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.8, 20000),
-    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.2, 20000),
-    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.5, 20000),
-    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.8, 20000)
+    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.2, max_steps, 0, 1, target_ess),
+    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.5, max_steps, 0, 1, target_ess),
+    ([0.2, 0.5, 0.3], [randint.pmf(i, 1, 4) for i in range(1, 4)], 3, 3, 0.8, max_steps, 0, 1, target_ess),
+    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.2, max_steps, 0, 1, target_ess),
+    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.5, max_steps, 0, 1, target_ess),
+    ([truncated_poisson_pmf(0, 11, i, lambda_poisson) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.8, max_steps, 0, 1, target_ess),
+    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.2, max_steps, 0, 1, target_ess),
+    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.5, max_steps, 0, 1, target_ess),
+    ([zipfian.pmf(i, a, 10) for i in range(1, 11)], [binom.pmf(i, 9, 0.3) for i in range(10)], 10, 3, 0.8, max_steps, 0, 1, target_ess)
 ]
 
-# -------------------------------------------------------------------------
-# Run the experiment
-# -------------------------------------------------------------------------
-results = {}
-for i, exp in enumerate(experiment_sets):
-    print(i)
-
-    offspring_distribution, dist_g, W_e, L_e, p, n_steps = exp
+# Number of replications of each experiment, used for the confidence intervals of the KL divergence
+n_replications = 1
 
-    result = experiment(offspring_distribution, dist_g, W_e, L_e, p, n_steps)
+# Base seed of the experiments
+seed = 0
 
-    results[i] = {
-        'kl_divergence': result[0],
-        'estimated_distribution': result[1]
-    }
+# Whether to profile the runs: the time of each stage and the behaviour of
+# the chain are stored with the results and streamed to results/profiles
+profile = False
 
-with open(results_dir+'experiment_results.pickle', 'wb') as file:
-    pickle.dump(results, file, protocol=pickle.HIGHEST_PROTOCOL)
+# Whether to store the states of every walk at results/chains, so that the
+# optimization can be run again on them without running the walks
+store_chains = False
 
+# -------------------------------------------------------------------------
+# Run the experiment
+# -------------------------------------------------------------------------
+# The experiments run in a process pool and each finished run is saved at
+# results/checkpoints, so running the script again resumes an interrupted run.
+if __name__ == '__main__':
+    results = run_experiments(experiment_sets, results_dir, n_replications, seed, profile=profile, profile_log=profile,
+                              store_chains=store_chains)
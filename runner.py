@@ -0,0 +1,207 @@
+# Description: Parallel and resumable runner for a list of experiments
+# Author: agent
+# Date: October 2026
+import os
+import pickle
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+from scipy.stats import t as student_t
+import instrumentation
+from chain_store import ChainStore, chain_path, configuration_digest
+from experiment import experiment
+from seeding import seed_process
+
+# -------------------------------------------------------------------------
+# Seed of a replication of an experiment
+# -------------------------------------------------------------------------
+# The seed only depends on the base seed and on the position of the run,
+# so a run gives the same result no matter the order or the process in
+# which it is executed.
+# -------------------------------------------------------------------------
+# seed: Base seed of the runner
+# index: Index of the experiment configuration
+# replication: Index of the replication
+# -------------------------------------------------------------------------
+# Returns: An integer seed
+# -------------------------------------------------------------------------
+def run_seed(seed, index, replication):
+    return int(np.random.SeedSequence([seed, index, replication]).generate_state(1, dtype=np.uint64)[0])
+
+# -------------------------------------------------------------------------
+# Path of the checkpoint of a run
+# -------------------------------------------------------------------------
+# Checkpoints are keyed by a digest of the configuration, together with
+# the options that change what a checkpoint holds, and by the seed of the
+# run, so a checkpoint is only reused by a run with the same arguments,
+# the same options and the same seed.
+# -------------------------------------------------------------------------
+# checkpoint_dir: Directory of the checkpoints
+# configuration: Arguments of experiment.experiment
+# seed: Seed of the run
+# profile: Whether the run is profiled (its checkpoint then holds the profile)
+# store_chains: Whether the run stores its chain (its checkpoint then holds
+#               the path of the chain)
+# -------------------------------------------------------------------------
+# Returns: The path of the checkpoint
+# -------------------------------------------------------------------------
+def checkpoint_path(checkpoint_dir, configuration, seed, profile=False, store_chains=False):
+    digest = configuration_digest([configuration, {'profile': profile, 'store_chains': store_chains}])
+    return os.path.join(checkpoint_dir, f'{digest}_seed_{seed}.pickle')
+
+# -------------------------------------------------------------------------
+# Write an object to a pickle file atomically
+# -------------------------------------------------------------------------
+# The object is written to a temporary file in the same directory, which
+# then replaces the destination, so a crash never leaves a partial file.
+# -------------------------------------------------------------------------
+# obj: Object to be written
+# path: Destination of the file
+# -------------------------------------------------------------------------
+def atomic_pickle_dump(obj, path):
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# -------------------------------------------------------------------------
+# Run a single replication of an experiment and checkpoint it
+# -------------------------------------------------------------------------
+# task: Tuple with the index of the configuration, the index of the
+#       replication, the seed, the configuration, the checkpoint path, the
+#       profiling options (None to run without profiling) and the directory
+#       where the chain is stored (None to discard it)
+# -------------------------------------------------------------------------
+# Returns: The index of the configuration and of the replication
+# -------------------------------------------------------------------------
+def _run_replication(task):
+    index, replication, seed, configuration, path, profiling, chain_dir = task
+
+    seed_process(seed)
+
+    if profiling is not None:
+        instrumentation.enable(**profiling)
+
+    chain_store = None
+    if chain_dir is not None:
+        chain_store = ChainStore(chain_dir, configuration, seed)
+
+    # Profiling is stopped even if the experiment fails, so the worker is left clean
+    try:
+        kl, theta = experiment(*configuration, chain_store=chain_store)
+    finally:
+        if profiling is not None:
+            summary = instrumentation.disable()
+
+    result = {'kl_divergence': kl, 'estimated_distribution': theta, 'seed': seed, 'chain_path': chain_dir}
+    if profiling is not None:
+        result['profile'] = summary
+
+    atomic_pickle_dump(result, path)
+
+    return index, replication
+
+# -------------------------------------------------------------------------
+# Confidence interval of the mean of a sample
+# -------------------------------------------------------------------------
+# values: The sample
+# confidence: Confidence level of the interval
+# -------------------------------------------------------------------------
+# Returns: The lower and upper bounds of the Student's t interval
+# -------------------------------------------------------------------------
+def confidence_interval(values, confidence=0.95):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return (np.nan, np.nan)
+    half_width = student_t.ppf((1 + confidence)/2, len(values) - 1) * values.std(ddof=1)/np.sqrt(len(values))
+    return (values.mean() - half_width, values.mean() + half_width)
+
+# -------------------------------------------------------------------------
+# Run every replication of every experiment in a process pool
+# -------------------------------------------------------------------------
+# Each finished replication is checkpointed, and the replications whose
+# checkpoint already exists are skipped, so an interrupted run can be
+# resumed by calling the function again with the same arguments. Runs
+# whose configuration or seed changed do not match any checkpoint and
+# are run again.
+# -------------------------------------------------------------------------
+# experiment_sets: A list with the arguments of experiment.experiment for each configuration
+# results_dir: Directory of the results
+# n_replications: Number of replications of each configuration
+# seed: Base seed of the runs
+# n_processes: Number of processes of the pool (one per core if None)
+# confidence: Confidence level of the intervals of the KL divergence
+# profile: Whether to profile the runs (see instrumentation.py), the profile
+#          of each run is stored with its results under 'profile'
+# profile_log: Whether to also stream the events of each profiled run to
+#              results/profiles/experiment_{index}_replication_{replication}.jsonl
+# store_chains: Whether to store the states of every walk at results/chains
+#               (see chain_store.py), keyed by configuration and seed
+# -------------------------------------------------------------------------
+# Returns: A dictionary with the results of each configuration
+# -------------------------------------------------------------------------
+def run_experiments(experiment_sets, results_dir, n_replications=1, seed=0, n_processes=None, confidence=0.95,
+                    profile=False, profile_log=False, store_chains=False):
+    checkpoint_dir = os.path.join(results_dir, 'checkpoints')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    profile_dir = os.path.join(results_dir, 'profiles')
+    if profile and profile_log:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    tasks = []
+    for index, configuration in enumerate(experiment_sets):
+        for replication in range(n_replications):
+            replication_seed = run_seed(seed, index, replication)
+            path = checkpoint_path(checkpoint_dir, configuration, replication_seed, profile, store_chains)
+            if os.path.exists(path):
+                continue
+
+            profiling = None
+            if profile:
+                log_path = None
+                if profile_log:
+                    log_path = os.path.join(profile_dir, f'experiment_{index}_replication_{replication}.jsonl')
+                profiling = {'log_path': log_path}
+
+            chain_dir = chain_path(os.path.join(results_dir, 'chains'), configuration, replication_seed) if store_chains else None
+
+            tasks.append((index, replication, replication_seed, configuration, path, profiling, chain_dir))
+
+    print(f'{len(experiment_sets)*n_replications - len(tasks)} runs already done, {len(tasks)} to go')
+
+    if n_processes == 1:
+        for task in tasks:
+            print(*_run_replication(task))
+    elif len(tasks) > 0:
+        with Pool(n_processes) as pool:
+            for index, replication in pool.imap_unordered(_run_replication, tasks):
+                print(index, replication)
+
+    # Gather the replications of each configuration
+    results = {}
+    for index, configuration in enumerate(experiment_sets):
+        replications = []
+        for replication in range(n_replications):
+            path = checkpoint_path(checkpoint_dir, configuration, run_seed(seed, index, replication), profile,
+                                   store_chains)
+            with open(path, 'rb') as file:
+                replications.append(pickle.load(file))
+
+        kl_divergences = np.array([r['kl_divergence'] for r in replications])
+        results[index] = {
+            'kl_divergence': kl_divergences.mean(),
+            'estimated_distribution': np.mean([r['estimated_distribution'] for r in replications], axis=0),
+            'kl_confidence_interval': confidence_interval(kl_divergences, confidence),
+            'replications': replications,
+        }
+
+    atomic_pickle_dump(results, os.path.join(results_dir, 'experiment_results.pickle'))
+
+    return results
@@ -1,81 +1,122 @@
 # Description: Functions for the sampling model of Graphs in Galson-Watson process
 # Author: Ronald Albert
 # Date: June 2023
+import time
 import networkx as nx
-import random
 import numpy as np
+from compact_tree import CompactTree, as_compact_tree
+from instrumentation import profile
+from permanent import batch_log_permanent
+from subtree_cache import CanonicalForms, canonical_ids
+
+# Number of pairs of subtrees whose map counts are evaluated in one batch
+_BATCH_SIZE = 2**20
 
 # -------------------------------------------------------------------------
-# The operator over the auxiliary matrix that returns the number of maps between S and G
+# Children of nodes with the same out-degree
 # -------------------------------------------------------------------------
-# maps_matrix: The auxiliary matrix
+# T: Tree
+# nodes: Nodes of T with k children each
+# k: Out-degree of the nodes
 # -------------------------------------------------------------------------
-# Returns: The number of maps between S and G
+# Returns: A (len(nodes) x k) array with the children of each node
 # -------------------------------------------------------------------------
-def _map_count_operator(maps_matrix):
-    if not isinstance(maps_matrix, np.ndarray):
-        return maps_matrix
-    elif maps_matrix.shape[0] == 1:
-        return maps_matrix.sum()
-    else:
-        new_maps = np.delete(maps_matrix, 0, 0)
-        return sum([maps_matrix[0,j]*_map_count_operator(np.delete(new_maps, j, 1)) for j in range(new_maps.shape[1])])
-    
+def _children_matrix(T, nodes, k):
+    return T.children[T.offsets[nodes][:, np.newaxis] + np.arange(k)]
+
+# -------------------------------------------------------------------------
+# Log of the number of maps between S and G
+# -------------------------------------------------------------------------
+# A node of S at depth d can only be mapped to a node of G at depth d, and
+# the number of maps between the subtrees rooted at them is the permanent
+# of the matrix of map counts between their children, since every child
+# of s must be mapped to a distinct child of g.
+#
+# The levels are visited from the deepest one up to the roots, keeping
+# only the table of the level below, so there is no recursion and no copy
+# of the trees. Isomorphic subtrees have the same map counts, so each
+# table only has one row per distinct shape of subtree of G and one column
+# per distinct shape of subtree of S at that level. The counts are kept in
+# log scale, since they overflow float64 on deep trees.
+# -------------------------------------------------------------------------
+# S: Sampled graph
+# G: Original graph
+# -------------------------------------------------------------------------
+# Returns: The log of the number of maps between S and G
+# -------------------------------------------------------------------------
+def _log_map_count(S, G):
+    forms = CanonicalForms(len(S) + len(G))
+    S_shape = canonical_ids(S, forms)
+    G_shape = canonical_ids(G, forms)
+
+    # Row or column of every node in the table of its level
+    S_index = np.empty(len(S), dtype=np.int64)
+    G_index = np.empty(len(G), dtype=np.int64)
+
+    table = None
+    for d in range(min(len(S.levels), len(G.levels)) - 1, -1, -1):
+        S_level, G_level = S.levels[d], G.levels[d]
+        _, S_first, S_index[S_level] = np.unique(S_shape[S_level], return_index=True, return_inverse=True)
+        _, G_first, G_index[G_level] = np.unique(G_shape[G_level], return_index=True, return_inverse=True)
+        S_nodes, G_nodes = S_level[S_first], G_level[G_first]
+
+        # The leaves of S are mapped to any node
+        level_table = np.tile(np.where(S.out_degree[S_nodes] == 0, 0.0, -np.inf), (len(G_nodes), 1))
+
+        # Pairs of nodes with k and c children are evaluated together as a batch of k x c matrices
+        for k in np.unique(S.out_degree[S_nodes]):
+            if k == 0:
+                continue
+            columns = np.flatnonzero(S.out_degree[S_nodes] == k)
+            S_children = S_index[_children_matrix(S, S_nodes[columns], k)]
+            for c in np.unique(G.out_degree[G_nodes]):
+                if c < k:
+                    continue
+                rows = np.flatnonzero(G.out_degree[G_nodes] == c)
+                G_children = G_index[_children_matrix(G, G_nodes[rows], c)]
+
+                # A subtree of S never fits in a smaller subtree of G
+                chunk = max(1, _BATCH_SIZE // len(columns))
+                for start in range(0, len(rows), chunk):
+                    fits = (S.subtree_size[S_nodes[columns]][np.newaxis, :]
+                            <= G.subtree_size[G_nodes[rows[start:start + chunk]]][:, np.newaxis])
+                    j, i = np.nonzero(fits)
+                    j += start
+                    blocks = table[G_children[j][:, np.newaxis, :], S_children[i][:, :, np.newaxis]]
+                    level_table[rows[j], columns[i]] = batch_log_permanent(blocks)
+                    if profile.enabled:
+                        profile.matrix_shape(k, c, len(blocks))
+        table = level_table
+
+    return table[G_index[0], S_index[0]]
+
 # -------------------------------------------------------------------------
-# Generate the auxiliary matrix that helps calculation in the map counting
+# Log of the sampling probability of S in a graph G
 # -------------------------------------------------------------------------
 # S: Sampled graph
 # G: Original graph
-# S_root: Root of S
-# G_root: Root of G
-# -------------------------------------------------------------------------
-# Returns: The auxiliary matrix
-# -------------------------------------------------------------------------
-def _count_maps_matrix(S, G, S_root=0, G_root=0):
-    S_graph = S.copy()
-    G_graph = G.copy()
-    # Base cases
-    if len(S.nodes()) == 1:
-        return np.array([1])
-    if len(S.nodes) > len(G.nodes):
-        return np.array([0])
-    else:
-        # Get the neighbors of the root of S and G
-        S_neighbors = [node for node in S_graph.neighbors(S_root)]
-        G_neighbors = [node for node in G_graph.neighbors(G_root)]
-
-        # Remove the root from S and G
-        S_graph.remove_node(S_root)
-        G_graph.remove_node(G_root)
-
-        # Get the connected components of S and G after removing the root
-        S_components = [S_graph.subgraph(c) for c in nx.weakly_connected_components(S_graph)]
-        G_components = [G_graph.subgraph(c) for c in nx.weakly_connected_components(G_graph)]
-        
-        # Initialize the auxiliary matrix
-        maps_matrix = np.empty([len(S_neighbors), len(G_neighbors)])
-        
-        # Iterate over the connected components of S and G, and calculate the number of maps between them
-        # Recursively call the function to calculate the number of maps between the connected components
-        for i, S_component in enumerate(S_components):
-            curr_map_array = np.empty(len(G_neighbors))
-            for j, G_component in enumerate(G_components):
-                 
-                for neighbor in S_neighbors:
-                    if neighbor in S_component:
-                        S_r = neighbor
-
-                for neighbor in G_neighbors:
-                    if neighbor in G_component:
-                        G_r = neighbor
-
-                maps_counted = _count_maps_matrix(S_component, G_component, S_r, G_r)
-                curr_map_array[j] = _map_count_operator(maps_counted)
-
-
-            maps_matrix[i,:] = curr_map_array
-        
-        return maps_matrix
+# p: Probability that a node from G is sampled into S
+# -------------------------------------------------------------------------
+# Returns: The log-probability that S is a sample subset of original graph G
+# -------------------------------------------------------------------------
+def log_sampling_probability(S, G, p, n_sampled_nodes):
+    S = as_compact_tree(S)
+    G = as_compact_tree(G)
+
+    if profile.enabled:
+        start = time.perf_counter()
+
+    # Log of the number of ways that S can be mapped into a subset of G
+    log_C_gs = _log_map_count(S, G)
+
+    if profile.enabled:
+        profile.add_time('map_counting', time.perf_counter() - start)
+        profile.count('map_count_trees')
+    if log_C_gs == -np.inf:
+        return -np.inf
+
+    # Return the log-probability that S is a sampled path of G
+    return log_C_gs + n_sampled_nodes*np.log(p) + (len(G) - n_sampled_nodes)*np.log1p(-p)
 
 # -------------------------------------------------------------------------
 # Sampling probability of S in a graph G
@@ -87,39 +128,133 @@ def _count_maps_matrix(S, G, S_root=0, G_root=0):
 # Returns: The probability that S is a sample subset of original graph G
 # -------------------------------------------------------------------------
 def sampling_probability(S, G, p, n_sampled_nodes):
-    # Number of ways that S can be mapped into a subset of G
-    C_gs = _map_count_operator(_count_maps_matrix(S, G)) 
-
-    # Return the probability that S is a sampled path of G
-    return C_gs * p**n_sampled_nodes * (1-p)**(len(G.nodes()) - n_sampled_nodes)
+    return np.exp(log_sampling_probability(S, G, p, n_sampled_nodes))
     
+# -------------------------------------------------------------------------
+# Close sets of nodes of G under the ancestor relation
+# -------------------------------------------------------------------------
+# The levels of G are visited from the deepest to the root. The children
+# of the nodes of a level, sorted by parent in the CSR layout, form one
+# segment per parent, so a single reduceat marks every parent that has a
+# marked child, for all the sets at once.
+# -------------------------------------------------------------------------
+# G: Tree
+# marked: Boolean array of shape (len(G), n_sets), one column per set of nodes
+# -------------------------------------------------------------------------
+# Returns: The columns of marked extended with all the ancestors of their nodes
+# -------------------------------------------------------------------------
+def ancestor_closure(G, marked):
+    closed = marked.copy()
+    child_depth = G.depth[G.children]
+
+    for d in range(G.height, 0, -1):
+        children = G.children[child_depth == d]
+        parents = G.levels[d - 1][G.out_degree[G.levels[d - 1]] > 0]
+        starts = np.concatenate([[0], np.cumsum(G.out_degree[parents])[:-1]])
+        closed[parents] |= np.logical_or.reduceat(closed[children], starts, axis=0)
+
+    return closed
+
+# -------------------------------------------------------------------------
+# Sample many paths from a graph G
+# -------------------------------------------------------------------------
+# Every node of G is sampled independently for every sample, with a single
+# vectorized draw, and the sampled graphs are the ancestor closures of the
+# sampled nodes.
+# -------------------------------------------------------------------------
+# G: Graph
+# p: Probability that a node from G is sampled into S, or an array with
+#    one probability per sample
+# n_samples: Number of independent samples
+# rng: A numpy random Generator (the global numpy random state if None)
+# -------------------------------------------------------------------------
+# Returns: A list of pairs (S, n_nodes) with the sampled graphs and their
+#          numbers of sampled nodes
+# -------------------------------------------------------------------------
+def sample_batch(G, p, n_samples, rng=None):
+    G = as_compact_tree(G)
+    rng = np.random if rng is None else rng
+
+    # Sample nodes from G
+    sampled = rng.random((len(G), n_samples)) < np.broadcast_to(p, (n_samples,))
+    n_nodes = sampled.sum(axis=0)
+
+    # Construct the sampled graphs S with the paths from the sampled nodes to the root of G
+    in_S = ancestor_closure(G, sampled)
+    in_S[0] = True
+
+    return [(G.induced_subtree(in_S[:, j]), int(n_nodes[j])) for j in range(n_samples)]
+
 # -------------------------------------------------------------------------
 # Sample path from a graph G with probability p
 # -------------------------------------------------------------------------
 # G: Graph
 # p: Probability that a node from G is sampled into S
+# rng: A numpy random Generator (the global numpy random state if None)
 # -------------------------------------------------------------------------
 # Returns: A sampled graph S of paths
 # -------------------------------------------------------------------------
-def sample(G, p):
-    S = nx.DiGraph()
-    nodes = []
-    n_nodes = 0
-    # Sample nodes from G
-    for node in G.nodes():
-        u = random.random()
-        if u < p:
-            nodes.append(node)
-            n_nodes += 1
+def sample(G, p, rng=None):
+    return sample_batch(G, p, 1, rng)[0]
+
+# -------------------------------------------------------------------------
+# Logarithm of an offspring distribution
+# -------------------------------------------------------------------------
+# Entries with probability 0 are mapped to 0, so that the corresponding
+# offspring counts are ignored by the likelihood.
+# -------------------------------------------------------------------------
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children, or a matrix with one distribution per row
+# -------------------------------------------------------------------------
+# Returns: An array with the logarithm of every positive entry
+# -------------------------------------------------------------------------
+def log_distribution(offspring_distribution):
+    offspring_distribution = np.asarray(offspring_distribution, dtype=np.float64)
+
+    log_dist = np.zeros(offspring_distribution.shape)
+    positive = offspring_distribution > 0
+    log_dist[positive] = np.log(offspring_distribution[positive])
+
+    return log_dist
+
+# -------------------------------------------------------------------------
+# Sufficient statistic of a graph G under a Galton-Watson process
+# -------------------------------------------------------------------------
+# A node with k children is counted in the entry k - 1, matching the
+# entry of the offspring distribution that accounts for it. Leaves are not
+# counted: they all lie on the last level, where the process stops, so no
+# entry of the distribution accounts for them.
+# -------------------------------------------------------------------------
+# G: Graph
+# W: Maximum out-degree of G
+# -------------------------------------------------------------------------
+# Returns: An array with the number of nodes accounted by each entry of the offspring distribution
+# -------------------------------------------------------------------------
+def offspring_count(G, W):
+    degree_count = np.bincount(as_compact_tree(G).out_degree, minlength=W + 1)
+    return degree_count_to_offspring_count(degree_count)
 
-    # Construct the sampled graph S with the paths from the sampled nodes to the root of G
-    for node in nodes:
-        paths = [path for path in nx.all_simple_edge_paths(G, 0, node)]
-        if len(paths) > 0:
-            path = paths[0]
-            S.add_edges_from(path)
+# -------------------------------------------------------------------------
+# Sufficient statistic from an out-degree histogram
+# -------------------------------------------------------------------------
+# degree_count: Number of nodes with 0, 1, ..., W children, the last axis
+#               indexing the out-degree
+# -------------------------------------------------------------------------
+# Returns: The offspring counts of the internal nodes
+# -------------------------------------------------------------------------
+def degree_count_to_offspring_count(degree_count):
+    return degree_count[..., 1:].copy()
 
-    return S, n_nodes
+# -------------------------------------------------------------------------
+# Log-probability of a graph G being generated from Galson-Watson process with offspring distribution
+# -------------------------------------------------------------------------
+# G: Graph
+# offspring_distribution: A list of probabilities that a node has k offsprings
+# -------------------------------------------------------------------------
+# Returns: The log-probability of G being generated from Galson-Watson process
+# -------------------------------------------------------------------------
+def log_galton_watson_probability(G, offspring_distribution):
+    return offspring_count(G, len(offspring_distribution)) @ log_distribution(offspring_distribution)
 
 # -------------------------------------------------------------------------
 # Probability of a graph G being generated from Galson-Watson process with offspring distribution
@@ -130,43 +265,84 @@ def sample(G, p):
 # Returns: The probability of G being generated from Galson-Watson process
 # -------------------------------------------------------------------------
 def galton_watson_probability(G, offspring_distribution):
-    out_degree = G.out_degree()
-    degrees = [val for (node, val) in out_degree]
+    return np.exp(log_galton_watson_probability(G, offspring_distribution))
 
-    prob = 1
-    # Calculate the probability of each node having k offsprings
-    for deegre in set(degrees):
-        if offspring_distribution[deegre - 1] != 0:
-            prob *= offspring_distribution[deegre - 1]**degrees.count(deegre)
+# -------------------------------------------------------------------------
+# Log-probability contributed by a node of each out-degree
+# -------------------------------------------------------------------------
+# Follows the conventions of offspring_count: a node with k children
+# contributes offspring_distribution[k - 1], leaves contribute nothing and
+# degrees with probability 0 are ignored.
+# -------------------------------------------------------------------------
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children
+# -------------------------------------------------------------------------
+# Returns: An array whose entry k is the log-probability of a node with k children
+# -------------------------------------------------------------------------
+def log_offspring_weights(offspring_distribution):
+    log_dist = log_distribution(offspring_distribution)
+    return np.concatenate([[0.0], log_dist])
+
+# -------------------------------------------------------------------------
+# Generate independent Galton-Watson trees
+# -------------------------------------------------------------------------
+# All the trees are grown together, level by level: the number of children
+# of every node of a level is drawn at once by inverting the cumulative
+# offspring distribution, and the parents of the next level are obtained
+# by repeating each node as many times as its number of children.
+# -------------------------------------------------------------------------
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
+#                         children
+# L: Number of levels of the trees
+# n_trees: Number of trees
+# rng: A numpy random Generator (the global numpy random state if None)
+# -------------------------------------------------------------------------
+# Returns: A list of n_trees Galton-Watson trees
+# -------------------------------------------------------------------------
+def galton_watson_forest(offspring_distribution, L, n_trees, rng=None):
+    rng = np.random if rng is None else rng
+    cumulative = np.cumsum(offspring_distribution, dtype=np.float64)
+    cumulative /= cumulative[-1]
 
-    return prob
+    # Nodes of the forest are labelled level by level
+    parent = [np.full(n_trees, -1, dtype=np.int64)]
+    tree = [np.arange(n_trees)]
+    level = np.arange(n_trees)
+
+    # Generate the simulated Galton-Watson trees level by level
+    for _ in range(L - 1):
+        u = rng.random(len(level))
+        n_children = np.minimum(np.searchsorted(cumulative, u, side='right'), len(cumulative) - 1) + 1
+
+        parent.append(np.repeat(level, n_children))
+        tree.append(np.repeat(tree[-1], n_children))
+        level = np.arange(level[-1] + 1, level[-1] + 1 + len(parent[-1]))
+
+    parent = np.concatenate(parent)
+    tree = np.concatenate(tree)
+
+    # Split the forest, relabelling the nodes of each tree from 0 in the same order
+    order = np.argsort(tree, kind='stable')
+    tree_sizes = np.bincount(tree, minlength=n_trees)
+    tree_starts = np.concatenate([[0], np.cumsum(tree_sizes)[:-1]])
+    local_label = np.empty(len(parent), dtype=np.int64)
+    local_label[order] = np.arange(len(parent)) - np.repeat(tree_starts, tree_sizes)
+
+    local_parent = np.where(parent >= 0, local_label[np.maximum(parent, 0)], -1)[order]
+    return [CompactTree(tree_parent) for tree_parent in np.split(local_parent, tree_starts[1:])]
 
 # -------------------------------------------------------------------------
 # Generate a Galton-Watson tree
 # -------------------------------------------------------------------------
-# offspring_distribution: A list of probabilities that a node has 0, 1, 2, ...
+# offspring_distribution: A list of probabilities that a node has 1, 2, ...
 #                         children
 # L: Number of levels of the tree
+# rng: A numpy random Generator (the global numpy random state if None)
 # -------------------------------------------------------------------------
 # Returns: A Galton-Watson tree
 # -------------------------------------------------------------------------
-def galton_watson(offspring_distribution, L):
-    G = nx.DiGraph()
-    G.add_node(0)
-
-    nodes_at_level = [[0]]
-
-    # Generate the simulated Galton-Watson tree level by level
-    for i in range(L - 1):
-        nodes_at_level.append([])
-        for v in nodes_at_level[i]:
-            nodes_to_add = random.choices(range(1, len(offspring_distribution) + 1), offspring_distribution)[0]
-            for _ in range(nodes_to_add):
-                G.add_node(len(G.nodes()))
-                G.add_edge(v, len(G.nodes())-1)
-                nodes_at_level[i+1].append(len(G.nodes())-1)
-
-    return G
+def galton_watson(offspring_distribution, L, rng=None):
+    return galton_watson_forest(offspring_distribution, L, 1, rng)[0]
 
 # -------------------------------------------------------------------------
 # Remove a tree from a graph
@@ -177,12 +353,8 @@ def galton_watson(offspring_distribution, L):
 # Returns: The graph G with the tree rooted at v removed
 # -------------------------------------------------------------------------
 def remove_tree(v, G):
-    # Base case: v is a leaf
-    if G.out_degree(v) == 0:
-        G.remove_node(v)
-    # Recursive case: v is not a leaf
-    else:
-        for u in G.copy().successors(v):
-            remove_tree(u, G)
-        G.remove_node(v)
-    return G
\ No newline at end of file
+    if not isinstance(G, nx.DiGraph):
+        return G.remove_subtree(v)
+
+    G.remove_nodes_from(nx.descendants(G, v) | {v})
+    return G
@@ -0,0 +1,30 @@
+# Description: Seeding of the random generators of the processes that run chains
+# Author: agent
+# Date: October 2026
+import random
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Seed the random generators of the current process
+# -------------------------------------------------------------------------
+# The chains draw their decisions from the random module and the trees
+# and samples from the global numpy generator, so both are seeded.
+# -------------------------------------------------------------------------
+# seed: A non-negative integer seed
+# -------------------------------------------------------------------------
+def seed_process(seed):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+# -------------------------------------------------------------------------
+# Independent seeds derived from a base seed
+# -------------------------------------------------------------------------
+# seed: Base seed, or a numpy SeedSequence to spawn from (which gives new
+#       seeds on every call)
+# n: Number of seeds
+# -------------------------------------------------------------------------
+# Returns: A list of n integer seeds
+# -------------------------------------------------------------------------
+def spawn_seeds(seed, n):
+    sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return [int(child.generate_state(1, dtype=np.uint64)[0]) for child in sequence.spawn(n)]
@@ -0,0 +1,111 @@
+# Description: Canonical forms of subtrees and a bounded cache of their map counts
+# Author: agent
+# Date: October 2026
+from collections import OrderedDict
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Least recently used cache with a bounded number of entries
+# -------------------------------------------------------------------------
+# maxsize: Maximum number of entries kept
+# -------------------------------------------------------------------------
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # -------------------------------------------------------------------------
+    # Value of a key, or None if it is not in the cache
+    # -------------------------------------------------------------------------
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    # -------------------------------------------------------------------------
+    # Store a value, evicting the least recently used entry if the cache is full
+    # -------------------------------------------------------------------------
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # -------------------------------------------------------------------------
+    # Usage statistics of the cache
+    # -------------------------------------------------------------------------
+    # Returns: A dictionary with the hits, misses, evictions, hit rate and size
+    # -------------------------------------------------------------------------
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits/lookups if lookups > 0 else 0.0,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+
+# -------------------------------------------------------------------------
+# Canonical identifiers of rooted unordered trees
+# -------------------------------------------------------------------------
+# Following the AHU algorithm, a tree is identified by the sorted tuple of
+# the identifiers of the subtrees of its children, which is interned into
+# an integer. Two subtrees receive the same identifier exactly when they
+# are isomorphic, so the identifier of a node only depends on the
+# identifiers of its children and is computed bottom-up.
+#
+# Identifiers are never reused: if the table is full, the least recently
+# used forms are forgotten and get a new identifier if they are seen again,
+# so stale entries of caches keyed by identifiers can only miss.
+# -------------------------------------------------------------------------
+# maxsize: Maximum number of forms kept
+# -------------------------------------------------------------------------
+class CanonicalForms:
+    def __init__(self, maxsize):
+        self.forms = LRUCache(maxsize)
+        self.next_id = 0
+
+    # -------------------------------------------------------------------------
+    # Identifier of a tree from the identifiers of the subtrees of its children
+    # -------------------------------------------------------------------------
+    # children_ids: Identifiers of the subtrees of the children of the root
+    # -------------------------------------------------------------------------
+    # Returns: The identifier of the tree
+    # -------------------------------------------------------------------------
+    def identify(self, children_ids):
+        form = tuple(sorted(children_ids))
+        shape_id = self.forms.get(form)
+        if shape_id is None:
+            shape_id = self.next_id
+            self.next_id += 1
+            self.forms.put(form, shape_id)
+        return shape_id
+
+
+# -------------------------------------------------------------------------
+# Canonical identifiers of all the subtrees of a tree
+# -------------------------------------------------------------------------
+# T: Tree whose children have larger labels than their parents
+# forms: The CanonicalForms in which the identifiers are interned
+# -------------------------------------------------------------------------
+# Returns: An array with the identifier of the subtree rooted at every node
+# -------------------------------------------------------------------------
+def canonical_ids(T, forms):
+    shape_ids = np.empty(len(T), dtype=np.int64)
+    for v in range(len(T) - 1, -1, -1):
+        shape_ids[v] = forms.identify(shape_ids[T.successors(v)].tolist())
+    return shape_ids